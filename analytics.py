@@ -0,0 +1,194 @@
+"""
+Analytics
+Update handlers append compact event tuples to an in-memory ring buffer;
+a background thread bulk-inserts them and rolls up hits per trigger per
+hour, so collecting events never touches the database on the reply path
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import insert, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Bot, Message, Button, AnalyticsEvent, TriggerHourlyHits
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Events written per INSERT; the flusher is woken early once this many are waiting
+BATCH_SIZE = 1000
+# Longest message text kept per event
+MAX_TEXT_LENGTH = 255
+# Seconds between deletions of raw events past the retention period
+PRUNE_INTERVAL = 3600
+
+_EVENT_FIELDS = ('created_at', 'bot_id', 'kind', 'chat_id', 'user_id', 'rule_kind', 'rule_id', 'text')
+
+
+class AnalyticsRecorder:
+    """Ring buffer of events plus the thread that flushes it to the database"""
+
+    def __init__(self, capacity=50000, interval=5.0, batch_size=BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        # deque append/popleft are atomic, so the event loop and the flusher
+        # share it without a lock; when full the oldest events are dropped
+        self._buffer = deque(maxlen=capacity)
+        self._wakeup = threading.Event()
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_prune = 0.0
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def start(self, app):
+        """Start the flusher for `app` once per process; safe to call repeatedly"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._run, daemon=True, name="AnalyticsFlusher")
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def record(self, bot_id, kind, chat_id, user_id, rule, text):
+        """Buffer one event; called from update handlers and never blocks"""
+        if len(self._buffer) == self._buffer.maxlen:
+            metrics.ANALYTICS_EVENTS.inc('dropped')
+        self._buffer.append((
+            datetime.utcnow(), bot_id, kind, chat_id, user_id,
+            rule.kind if rule else None, rule.id if rule else None,
+            text[:MAX_TEXT_LENGTH] if text else None,
+        ))
+        metrics.ANALYTICS_EVENTS.inc('recorded')
+        if len(self._buffer) >= self.batch_size and not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def flush(self):
+        """Write every buffered event, returns how many were written"""
+        if self._app is None:
+            return 0
+        written = 0
+        with self._flush_lock:
+            while self._buffer:
+                batch = []
+                try:
+                    while len(batch) < self.batch_size:
+                        batch.append(self._buffer.popleft())
+                except IndexError:
+                    pass
+                try:
+                    with self._app.app_context():
+                        self._write(batch)
+                except Exception:
+                    # Analytics are best effort: drop the batch rather than retry forever
+                    metrics.ANALYTICS_EVENTS.inc('failed', amount=len(batch))
+                    logger.exception("Error writing %d analytics event(s)", len(batch))
+                    continue
+                metrics.ANALYTICS_EVENTS.inc('flushed', amount=len(batch))
+                written += len(batch)
+        return written
+
+    def _write(self, batch):
+        """Insert a batch and add it to the hourly rollups in one transaction"""
+        hourly = {}
+        for event in batch:
+            key = (event[1], event[0].replace(minute=0, second=0, microsecond=0), event[5] or '', event[6] or 0)
+            hourly[key] = hourly.get(key, 0) + 1
+
+        db.session.execute(insert(AnalyticsEvent), [dict(zip(_EVENT_FIELDS, event)) for event in batch])
+        upsert = sqlite_insert(TriggerHourlyHits)
+        db.session.execute(
+            upsert.on_conflict_do_update(
+                index_elements=['bot_id', 'hour', 'rule_kind', 'rule_id'],
+                set_={'hits': TriggerHourlyHits.hits + upsert.excluded.hits}
+            ),
+            [
+                {'bot_id': bot_id, 'hour': hour, 'rule_kind': rule_kind, 'rule_id': rule_id, 'hits': hits}
+                for (bot_id, hour, rule_kind, rule_id), hits in hourly.items()
+            ]
+        )
+        db.session.commit()
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(days=Config.ANALYTICS_RETENTION_DAYS)
+        with self._app.app_context():
+            deleted = AnalyticsEvent.query.filter(AnalyticsEvent.created_at < cutoff).delete(synchronize_session=False)
+            db.session.commit()
+        if deleted:
+            logger.info("Pruned %d analytics event(s) older than %d days", deleted, Config.ANALYTICS_RETENTION_DAYS)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.monotonic() - self._last_prune > PRUNE_INTERVAL:
+                    self._last_prune = time.monotonic()
+                    self._prune()
+            except Exception:
+                logger.exception("Error in analytics flusher")
+
+
+recorder = AnalyticsRecorder(Config.ANALYTICS_BUFFER_SIZE, Config.ANALYTICS_FLUSH_INTERVAL)
+
+metrics.registry.register(metrics.Gauge(
+    'analytics_buffered_events', 'Analytics events waiting for the background flusher',
+    collect=lambda: [((), recorder.pending)]
+))
+
+
+def get_trigger_activity(user_id, hours=24, limit=10):
+    """Hourly hits for a user's busiest triggers over the last `hours`
+
+    Returns (per-bot totals {bot_id: hits}, triggers) where each trigger is
+    a dict with bot_id, kind, id, text, total and `series`, one hit count
+    per hour, oldest first.
+    """
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    since = now - timedelta(hours=hours - 1)
+    rows = (
+        db.session.query(
+            TriggerHourlyHits.bot_id, TriggerHourlyHits.rule_kind, TriggerHourlyHits.rule_id,
+            TriggerHourlyHits.hour, func.sum(TriggerHourlyHits.hits)
+        )
+        .join(Bot, Bot.id == TriggerHourlyHits.bot_id)
+        .filter(Bot.user_id == user_id, TriggerHourlyHits.hour >= since)
+        .group_by(TriggerHourlyHits.bot_id, TriggerHourlyHits.rule_kind, TriggerHourlyHits.rule_id, TriggerHourlyHits.hour)
+        .all()
+    )
+
+    bot_totals = {}
+    series = {}
+    for bot_id, rule_kind, rule_id, hour, hits in rows:
+        bot_totals[bot_id] = bot_totals.get(bot_id, 0) + hits
+        index = int((hour - since).total_seconds() // 3600)
+        series.setdefault((bot_id, rule_kind, rule_id), [0] * hours)[index] += hits
+
+    top = sorted(series.items(), key=lambda item: sum(item[1]), reverse=True)[:limit]
+    texts = {}
+    for kind, model, column in (('message', Message, Message.trigger_text), ('button', Button, Button.button_text)):
+        ids = [rule_id for (_, rule_kind, rule_id), _ in top if rule_kind == kind]
+        if ids:
+            texts.update(((kind, rule_id), text) for rule_id, text in db.session.query(model.id, column).filter(model.id.in_(ids)))
+
+    triggers = [
+        {
+            'bot_id': bot_id,
+            'kind': rule_kind or None,
+            'id': rule_id or None,
+            'text': texts.get((rule_kind, rule_id)),
+            'total': sum(counts),
+            'series': counts,
+        }
+        for (bot_id, rule_kind, rule_id), counts in top
+    ]
+    return bot_totals, triggers
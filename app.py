@@ -1,22 +1,33 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context
 from flask_wtf import FlaskForm, CSRFProtect
-from wtforms import StringField, PasswordField, TextAreaField, BooleanField
-from wtforms.validators import DataRequired, EqualTo, Length, ValidationError
+from wtforms import StringField, PasswordField, TextAreaField, BooleanField, SelectField
+from wtforms.validators import DataRequired, EqualTo, Length, Optional, Regexp, ValidationError
 from models import db, User, Bot, Message, Button
+from matcher import MATCH_TYPES, DEFAULT_MATCH_TYPE, validate_regex
+from conversation_state import MAX_STATE_LENGTH
 from config import Config
-from bot_handler import start_bot, stop_bot, initialize_bots, monitor_bots
+from bot_handler import initialize_bots, monitor_bots, notify_bot_changed, notify_rules_changed, dispatch_webhook_update
+from rule_cache import rule_cache
+from rule_tester import iter_sample_messages, match_sample, run_bulk_test
+import rule_io
+from rule_listing import PAGE_SIZE, RULE_MODELS, count_rules, list_rules
+from response_template import render_response
+from token_status import token_status
+from bot_stats import get_user_bot_stats
+from analytics import get_trigger_activity
+from migrations import run_migrations
+import metrics
 import re
-import requests
 import threading
 from functools import wraps
 
-# Setup logging to file
+# Setup queued logging to console and file
 try:
     from setup_logging import setup_logging
-    log_file_handle = setup_logging()
+    log_listener = setup_logging()
 except Exception as e:
     print(f"Warning: Could not setup file logging: {e}")
-    log_file_handle = None
+    log_listener = None
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -71,14 +82,40 @@ class BotForm(FlaskForm):
             raise ValidationError('Invalid token format. Telegram bot tokens should be in format: 123456789:ABCdefGHIjklMNOpqrsTUVwxyz')
 
 
+def state_field(label):
+    """Optional conversation state name: letters, digits, '_' and '-'"""
+    return StringField(label, validators=[
+        Optional(), Length(max=MAX_STATE_LENGTH),
+        Regexp(r'^[\w-]+$', message='Use letters, digits, "_" and "-" only.')
+    ], filters=[lambda value: value.strip() if value else value])
+
+
 class MessageForm(FlaskForm):
     trigger_text = StringField('Trigger Text', validators=[DataRequired(), Length(max=500)])
+    match_type = SelectField('Match Type', choices=MATCH_TYPES, default=DEFAULT_MATCH_TYPE)
     response_text = TextAreaField('Response Text', validators=[DataRequired()])
+    state = state_field('Only In State')
+    next_state = state_field('Then Set State')
+    
+    def validate_trigger_text(self, trigger_text):
+        if self.match_type.data == 'regex':
+            error = validate_regex(trigger_text.data)
+            if error:
+                raise ValidationError(f'Invalid regular expression: {error}')
 
 
 class ButtonForm(FlaskForm):
     button_text = StringField('Button Text', validators=[DataRequired(), Length(max=100)])
+    match_type = SelectField('Match Type', choices=MATCH_TYPES, default=DEFAULT_MATCH_TYPE)
     response_text = TextAreaField('Response Text', validators=[DataRequired()])
+    state = state_field('Only In State')
+    next_state = state_field('Then Set State')
+    
+    def validate_button_text(self, button_text):
+        if self.match_type.data == 'regex':
+            error = validate_regex(button_text.data)
+            if error:
+                raise ValidationError(f'Invalid regular expression: {error}')
 
 
 # Helper functions
@@ -94,15 +131,7 @@ def login_required(f):
 
 def validate_telegram_token(token):
     """Validate Telegram bot token by calling API"""
-    try:
-        url = f'https://api.telegram.org/bot{token}/getMe'
-        response = requests.get(url, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('ok', False)
-        return False
-    except:
-        return False
+    return token_status.check(token)
 
 
 # Routes
@@ -113,6 +142,27 @@ def favicon():
     response.headers['Cache-Control'] = 'public, max-age=3600'
     return response
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint for bot runtime metrics
+
+    With BOT_RUNNER=external the bots run in bot_runner workers, so their
+    metrics are not in this process and this only has the panel's own.
+    """
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/telegram/webhook/<int:bot_id>/<secret>', methods=['POST'])
+@csrf.exempt
+def telegram_webhook(bot_id, secret):
+    """Receive updates for every bot running in webhook mode"""
+    accepted = dispatch_webhook_update(
+        bot_id,
+        secret,
+        request.headers.get('X-Telegram-Bot-Api-Secret-Token'),
+        request.get_json(silent=True)
+    )
+    return Response(status=200 if accepted else 404)
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -173,6 +223,7 @@ def register():
             )
             db.session.add(bot)
             db.session.commit()
+            notify_bot_changed(bot.id)
             
             session['user_id'] = user.id
             session['username'] = user.username
@@ -197,22 +248,20 @@ def logout():
 @login_required
 def dashboard():
     user = User.query.get(session['user_id'])
-    bots = Bot.query.filter_by(user_id=user.id).all()
     
-    # Get bot statistics
-    bot_stats = []
-    for bot in bots:
-        messages_count = Message.query.filter_by(bot_id=bot.id).count()
-        buttons_count = Button.query.filter_by(bot_id=bot.id).count()
-        token_valid = validate_telegram_token(bot.token)
-        bot_stats.append({
-            'bot': bot,
-            'messages_count': messages_count,
-            'buttons_count': buttons_count,
-            'token_valid': token_valid
-        })
+    # Bots and rule counts in one query; token status comes from the background-refreshed cache
+    bot_stats = get_user_bot_stats(user.id)
+    # Hourly trigger rollups written by the analytics flusher
+    bot_hits, trigger_activity = get_trigger_activity(user.id)
+    for stat in bot_stats:
+        stat['token_valid'] = token_status.get(stat['bot'].token)
+        stat['hits_24h'] = bot_hits.get(stat['bot'].id, 0)
+    bot_names = {stat['bot'].id: stat['bot'].name for stat in bot_stats}
     
-    return render_template('dashboard.html', user=user, bot_stats=bot_stats)
+    return render_template(
+        'dashboard.html', user=user, bot_stats=bot_stats,
+        trigger_activity=trigger_activity, bot_names=bot_names
+    )
 
 
 @app.route('/bot/create', methods=['GET', 'POST'])
@@ -235,9 +284,8 @@ def create_bot():
         try:
             db.session.add(bot)
             db.session.commit()
-            # Start bot if it's active
-            if bot.is_active:
-                start_bot(bot, app)
+            # Bot monitor starts it if it's active
+            notify_bot_changed(bot.id)
             flash('Bot created successfully!', 'success')
             return redirect(url_for('dashboard'))
         except Exception as e:
@@ -270,11 +318,11 @@ def edit_bot(bot_id):
         
         try:
             db.session.commit()
-            # Restart bot if token changed or if it's active
-            if old_token != bot.token or bot.is_active:
-                stop_bot(bot.id)
-                if bot.is_active:
-                    start_bot(bot, app)
+            if bot.token != old_token:
+                # The old token's cached status would otherwise linger until its TTL
+                token_status.invalidate(old_token)
+            # The bot monitor restarts the bot only if its token changed; other edits are hot-swapped
+            notify_bot_changed(bot.id)
             flash('Bot updated successfully!', 'success')
             return redirect(url_for('dashboard'))
         except Exception as e:
@@ -296,11 +344,8 @@ def toggle_bot(bot_id):
     bot.is_active = not bot.is_active
     try:
         db.session.commit()
-        # Start or stop bot based on new status
-        if bot.is_active:
-            start_bot(bot, app)
-        else:
-            stop_bot(bot.id)
+        # Bot monitor starts or stops the bot based on new status
+        notify_bot_changed(bot.id)
         return jsonify({'success': True, 'is_active': bot.is_active})
     except Exception as e:
         db.session.rollback()
@@ -317,10 +362,13 @@ def delete_bot(bot_id):
         return redirect(url_for('dashboard'))
     
     try:
-        # Stop bot before deleting
-        stop_bot(bot.id)
+        token = bot.token
         db.session.delete(bot)
         db.session.commit()
+        token_status.invalidate(token)
+        notify_rules_changed(bot_id)
+        # Bot monitor stops the deleted bot
+        notify_bot_changed(bot_id)
         flash('Bot deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -343,19 +391,27 @@ def manage_messages(bot_id):
         message = Message(
             bot_id=bot.id,
             trigger_text=form.trigger_text.data,
-            response_text=form.response_text.data
+            match_type=form.match_type.data,
+            response_text=form.response_text.data,
+            state=form.state.data or None,
+            next_state=form.next_state.data or None
         )
         try:
             db.session.add(message)
             db.session.commit()
+            notify_rules_changed(bot.id)
             flash('Message added successfully!', 'success')
             return redirect(url_for('manage_messages', bot_id=bot.id))
         except:
             db.session.rollback()
             flash('Failed to add message.', 'error')
     
-    messages = Message.query.filter_by(bot_id=bot.id).all()
-    return render_template('messages.html', bot=bot, messages=messages, form=form)
+    query = request.args.get('q', '').strip()
+    messages, next_after = list_rules(bot.id, 'message', query)
+    return render_template(
+        'messages.html', bot=bot, messages=messages, next_after=next_after, query=query,
+        total=count_rules(bot.id, 'message'), form=form, match_types=dict(MATCH_TYPES)
+    )
 
 
 @app.route('/message/<int:message_id>/delete', methods=['POST'])
@@ -371,6 +427,7 @@ def delete_message(message_id):
     try:
         db.session.delete(message)
         db.session.commit()
+        notify_rules_changed(bot.id)
         flash('Message deleted successfully!', 'success')
     except:
         db.session.rollback()
@@ -393,19 +450,27 @@ def manage_buttons(bot_id):
         button = Button(
             bot_id=bot.id,
             button_text=form.button_text.data,
-            response_text=form.response_text.data
+            match_type=form.match_type.data,
+            response_text=form.response_text.data,
+            state=form.state.data or None,
+            next_state=form.next_state.data or None
         )
         try:
             db.session.add(button)
             db.session.commit()
+            notify_rules_changed(bot.id)
             flash('Button added successfully!', 'success')
             return redirect(url_for('manage_buttons', bot_id=bot.id))
         except:
             db.session.rollback()
             flash('Failed to add button.', 'error')
     
-    buttons = Button.query.filter_by(bot_id=bot.id).all()
-    return render_template('buttons.html', bot=bot, buttons=buttons, form=form)
+    query = request.args.get('q', '').strip()
+    buttons, next_after = list_rules(bot.id, 'button', query)
+    return render_template(
+        'buttons.html', bot=bot, buttons=buttons, next_after=next_after, query=query,
+        total=count_rules(bot.id, 'button'), form=form, match_types=dict(MATCH_TYPES)
+    )
 
 
 @app.route('/button/<int:button_id>/delete', methods=['POST'])
@@ -421,6 +486,7 @@ def delete_button(button_id):
     try:
         db.session.delete(button)
         db.session.commit()
+        notify_rules_changed(bot.id)
         flash('Button deleted successfully!', 'success')
     except:
         db.session.rollback()
@@ -429,6 +495,111 @@ def delete_button(button_id):
     return redirect(url_for('manage_buttons', bot_id=bot.id))
 
 
+@app.route('/bot/<int:bot_id>/rules')
+@login_required
+def list_bot_rules(bot_id):
+    """JSON page of a bot's messages or buttons for search and load-more"""
+    bot = Bot.query.get_or_404(bot_id)
+    
+    if bot.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    kind = request.args.get('kind', 'message')
+    if kind not in RULE_MODELS:
+        return jsonify({'success': False, 'message': 'kind must be message or button'}), 400
+    
+    rules, next_after = list_rules(
+        bot.id, kind, request.args.get('q'),
+        after=request.args.get('after', type=int), limit=request.args.get('limit', PAGE_SIZE, type=int)
+    )
+    text_column = RULE_MODELS[kind][1]
+    return jsonify({
+        'success': True,
+        'rules': [
+            {
+                'id': rule.id, 'text': getattr(rule, text_column), 'match_type': rule.match_type,
+                'response_text': rule.response_text, 'state': rule.state, 'next_state': rule.next_state,
+            }
+            for rule in rules
+        ],
+        # Rendered like the page's own rows so the table can append them as is
+        'html': render_template('_rule_rows.html', rules=rules, kind=kind, match_types=dict(MATCH_TYPES)),
+        'next': next_after,
+    })
+
+
+@app.route('/bot/<int:bot_id>/rules/import', methods=['POST'])
+@login_required
+def import_bot_rules(bot_id):
+    """Bulk-add messages and buttons from a CSV or JSON Lines upload"""
+    bot = Bot.query.get_or_404(bot_id)
+    
+    if bot.user_id != session['user_id']:
+        flash('You do not have permission to access this bot.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    kind = request.form.get('kind', 'message')
+    if kind not in rule_io.RULE_KINDS:
+        kind = 'message'
+    back = url_for('manage_buttons' if kind == 'button' else 'manage_messages', bot_id=bot.id)
+    upload = request.files.get('rules')
+    if upload is None or not upload.filename:
+        flash('Choose a CSV or JSON Lines file to import.', 'error')
+        return redirect(back)
+    
+    fmt = request.form.get('format') or rule_io.detect_format(upload.filename)
+    if fmt not in rule_io.FORMATS:
+        flash('Unknown import format.', 'error')
+        return redirect(back)
+    
+    try:
+        counts = rule_io.import_rules(
+            bot.id, rule_io.iter_records(upload.stream, fmt),
+            default_kind=kind, replace=request.form.get('mode') == 'replace'
+        )
+    except rule_io.RuleImportError as e:
+        details = '; '.join(f"line {error['line']}: {error['error']}" for error in e.errors[:5])
+        flash(f'Nothing was imported, {len(e.errors)} invalid row(s) found: {details}', 'error')
+        return redirect(back)
+    except Exception:
+        app.logger.exception("Error importing rules for bot %s", bot.id)
+        flash('Failed to import rules.', 'error')
+        return redirect(back)
+    
+    # One reload for the whole import
+    notify_rules_changed(bot.id)
+    flash(f"Imported {counts['message']} message(s) and {counts['button']} button(s).", 'success')
+    return redirect(back)
+
+
+@app.route('/bot/<int:bot_id>/rules/export')
+@login_required
+def export_bot_rules(bot_id):
+    """Stream a bot's messages and buttons as CSV or JSON Lines"""
+    bot = Bot.query.get_or_404(bot_id)
+    
+    if bot.user_id != session['user_id']:
+        flash('You do not have permission to access this bot.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in rule_io.FORMATS:
+        fmt = 'csv'
+    kind = request.args.get('kind')
+    kinds = [kind] if kind in rule_io.RULE_KINDS else None
+    
+    rows = rule_io.iter_rules(bot.id, kinds)
+    if fmt == 'csv':
+        body, mimetype = rule_io.to_csv(rows), 'text/csv'
+    else:
+        body, mimetype = rule_io.to_json_lines(rows), 'application/x-ndjson'
+    filename = f"bot-{bot.id}-{kind + 's' if kinds else 'rules'}.{fmt}"
+    return Response(
+        stream_with_context(body), mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
 @app.route('/bot/<int:bot_id>/test', methods=['GET', 'POST'])
 @login_required
 def test_bot(bot_id):
@@ -438,46 +609,71 @@ def test_bot(bot_id):
         flash('You do not have permission to test this bot.', 'error')
         return redirect(url_for('dashboard'))
     
-    messages_count = Message.query.filter_by(bot_id=bot.id).count()
-    buttons_count = Button.query.filter_by(bot_id=bot.id).count()
-    messages = Message.query.filter_by(bot_id=bot.id).all()
-    buttons = Button.query.filter_by(bot_id=bot.id).all()
+    # Same cached rules and matcher the running bot uses
+    rules = rule_cache.get(app, bot.id)
+    messages_count = len(rules.messages)
+    buttons_count = len(rules.buttons)
+    # Only the first triggers are listed; the manage pages page through the rest
+    messages = rules.messages[:PAGE_SIZE]
+    buttons = rules.buttons[:PAGE_SIZE]
     
+    state = None
     if request.method == 'POST':
         test_message = request.form.get('test_message', '')
+        state = request.form.get('state', '').strip() or None
         if test_message:
             # This is a simple test - in a real scenario, you'd send to Telegram
             # For now, we'll just show what response would be sent
-            response = None
-            # Check buttons first
-            for button in buttons:
-                if button.button_text.lower() in test_message.lower():
-                    response = button.response_text
-                    break
-            
-            # Then check messages
-            if not response:
-                for msg in messages:
-                    if msg.trigger_text.lower() in test_message.lower():
-                        response = msg.response_text
-                        break
+            rule, latency_us = match_sample(rules, test_message, state)
             
-            if response:
-                flash(f'Bot would respond: {response}', 'success')
+            if rule:
+                flash(f'Bot would respond: {render_response(rule)} (matched {rule.kind} "{rule.text}" in {latency_us:.0f} µs)', 'success')
+                # Carry the conversation on to the next test message like a chat would
+                if rule.next_state:
+                    state = rule.next_state
+                elif rule.state:
+                    state = None
             else:
                 flash('No matching trigger found. Bot would not respond.', 'info')
     
-    return render_template('test_bot.html', bot=bot, messages_count=messages_count, buttons_count=buttons_count, messages=messages, buttons=buttons)
+    return render_template(
+        'test_bot.html', bot=bot, messages_count=messages_count, buttons_count=buttons_count,
+        messages=messages, buttons=buttons, state=state
+    )
+
+
+@app.route('/bot/<int:bot_id>/test/bulk', methods=['POST'])
+@login_required
+def test_bot_bulk(bot_id):
+    """Match every line of an uploaded file, streaming one JSON result per line"""
+    bot = Bot.query.get_or_404(bot_id)
+    
+    if bot.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    upload = request.files.get('messages')
+    if upload is None:
+        return jsonify({'success': False, 'message': 'Upload a file in the "messages" field'}), 400
+    
+    rules = rule_cache.get(app, bot.id)
+    results = run_bulk_test(rules, iter_sample_messages(upload.stream))
+    return Response(stream_with_context(rule_io.to_json_lines(results)), mimetype='application/x-ndjson')
 
 
 # Initialize database
-with app.app_context():
-    db.create_all()
-    # Initialize active bots
-    initialize_bots(app)
-    # Start bot monitor thread
-    monitor_thread = threading.Thread(target=monitor_bots, args=(app,), daemon=True)
-    monitor_thread.start()
+run_migrations(app)
+# With BOT_RUNNER=external the bots run under bot_runner.py and the panel only sends it commands
+if Config.BOT_RUNNER == 'external':
+    from bot_runner import authkey
+    # Refuse to start without a dedicated control channel secret
+    authkey()
+elif Config.BOT_RUNNER == 'embedded':
+    with app.app_context():
+        # Active bots start in a background thread, so the panel serves requests right away
+        initialize_bots(app)
+        # Start bot monitor thread
+        monitor_thread = threading.Thread(target=monitor_bots, args=(app,), daemon=True)
+        monitor_thread.start()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,352 @@
+"""
+Benchmark Suite - Measure the message handling hot path
+Seeds synthetic bots into a temporary SQLite database, drives
+get_bot_response, handle_message and handle_button_click with synthetic
+or recorded updates, and compares the results against saved baselines
+
+Usage:
+    python benchmark.py                       # run the default grid
+    python benchmark.py --save main           # save results as benchmarks/main.json
+    python benchmark.py --compare main        # fail if slower than the baseline
+    python benchmark.py --updates updates.jsonl --rules 1000
+"""
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from flask import Flask
+from models import db, User, Bot, Message, Button
+from migrations import run_migrations
+from send_scheduler import SendScheduler
+
+BASELINE_DIR = Path(__file__).parent / "benchmarks"
+WORDS = [
+    'hello', 'price', 'order', 'help', 'menu', 'delivery', 'refund', 'status', 'account',
+    'support', 'shipping', 'payment', 'invoice', 'cancel', 'discount', 'contact', 'hours',
+    'address', 'login', 'password', 'track', 'return', 'size', 'color', 'stock', 'news'
+]
+
+
+class SyntheticMessage:
+    """Minimal stand-in for telegram.Message used by handle_message"""
+
+    def __init__(self, text, chat_id=1):
+        self.text = text
+        self.chat_id = chat_id
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class SyntheticCallbackQuery:
+    """Minimal stand-in for telegram.CallbackQuery used by handle_button_click"""
+
+    def __init__(self, data):
+        self.data = data
+        self.message = SyntheticMessage('menu')
+        self.from_user = SyntheticUser()
+        self.answers = 0
+        self.edits = []
+
+    async def answer(self, *args, **kwargs):
+        self.answers += 1
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+
+class SyntheticUser:
+    """Minimal stand-in for telegram.User and a private telegram.Chat"""
+
+    def __init__(self, user_id=1):
+        self.id = user_id
+        self.first_name = 'Bench'
+        self.last_name = 'User'
+        self.full_name = 'Bench User'
+        self.username = 'bench_user'
+        self.title = None
+
+
+class SyntheticUpdate:
+    def __init__(self, text=None, callback_data=None):
+        self.message = SyntheticMessage(text) if text is not None else None
+        self.callback_query = SyntheticCallbackQuery(callback_data) if callback_data is not None else None
+        self.effective_user = self.effective_chat = SyntheticUser()
+
+
+class SyntheticContext:
+    def __init__(self, app, bot_id):
+        self.bot_data = {'bot_id': bot_id, 'app': app, 'scheduler': SendScheduler(bot_id, rate_limited=False)}
+
+
+def create_benchmark_app(db_path):
+    """Create a bare Flask app bound to a temporary SQLite database"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    run_migrations(app)
+    return app
+
+
+def seed_bot(app, buttons, triggers, rng, mixed_types=0.0):
+    """Create a bot with N buttons and M triggers, returns (bot_id, button_texts, trigger_texts)
+
+    `mixed_types` is the share of triggers using a whole-word, prefix or
+    regex match instead of substring.
+    """
+    def phrase(index):
+        return f"{rng.choice(WORDS)} {rng.choice(WORDS)} {index}"
+
+    def match_type():
+        return rng.choice(('word', 'prefix', 'regex')) if rng.random() < mixed_types else 'substring'
+
+    def trigger(text, kind):
+        return re.escape(text) if kind == 'regex' else text
+
+    def response(index, text):
+        return f"Good {{time_of_day}} {{first_name}}, response to {text}" if index % 2 else f"Response to {text}"
+
+    with app.app_context():
+        user = User(username=f"bench{rng.random()}", first_name='Bench', last_name='User')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.flush()
+        bot = Bot(user_id=user.id, name='Benchmark Bot', token='0:benchmark', is_active=False)
+        db.session.add(bot)
+        db.session.flush()
+        button_texts = [f"btn {phrase(i)}" for i in range(buttons)]
+        trigger_texts = [f"trg {phrase(i)}" for i in range(triggers)]
+        # Every other response is a template so rendering is part of the measurement
+        db.session.add_all(
+            Button(bot_id=bot.id, button_text=text, response_text=response(i, text))
+            for i, text in enumerate(button_texts)
+        )
+        types = [match_type() for _ in trigger_texts]
+        db.session.add_all(
+            Message(bot_id=bot.id, trigger_text=trigger(text, kind), match_type=kind, response_text=response(i, text))
+            for i, (text, kind) in enumerate(zip(trigger_texts, types))
+        )
+        db.session.commit()
+        return bot.id, button_texts, trigger_texts
+
+
+def synthetic_messages(count, length, rule_texts, hit_rate, rng):
+    """Generate messages of roughly `length` characters, a share of which contain a rule"""
+    messages = []
+    for _ in range(count):
+        words = []
+        while sum(len(w) + 1 for w in words) < length:
+            words.append(rng.choice(WORDS) + 'x')
+        if rule_texts and rng.random() < hit_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(rule_texts))
+        messages.append(' '.join(words))
+    return messages
+
+
+def load_recorded_updates(path):
+    """Load recorded Telegram updates (JSON Lines) as SyntheticUpdate objects"""
+    updates = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get('message', {}).get('text') is not None:
+                updates.append(SyntheticUpdate(text=data['message']['text']))
+            elif data.get('callback_query', {}).get('data') is not None:
+                updates.append(SyntheticUpdate(callback_data=data['callback_query']['data']))
+    return updates
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, wall_time):
+    """Summarize per-call latencies (seconds) into ms percentiles and throughput"""
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 4),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 4) if latencies else 0.0,
+        'updates_per_sec': round(len(latencies) / wall_time, 1) if wall_time else 0.0,
+    }
+
+
+def bench_get_bot_response(app, bot_id, messages):
+    from bot_handler import get_bot_response
+    latencies = []
+    started = time.perf_counter()
+    for text in messages:
+        t0 = time.perf_counter()
+        get_bot_response(app, bot_id, text)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def bench_async_handler(handler, app, bot_id, updates, concurrency=1):
+    """Drive an async handler, `concurrency` updates at a time, on a fresh loop"""
+    context = SyntheticContext(app, bot_id)
+    latencies = []
+
+    async def timed(update):
+        t0 = time.perf_counter()
+        await handler(update, context)
+        latencies.append(time.perf_counter() - t0)
+
+    async def drive():
+        for start in range(0, len(updates), concurrency):
+            await asyncio.gather(*(timed(u) for u in updates[start:start + concurrency]))
+        # Handlers only queue their sends; let them finish before the loop closes
+        await context.bot_data['scheduler'].join()
+
+    started = time.perf_counter()
+    asyncio.run(drive())
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_scenario(app, rules, length, count, hit_rate, concurrency, rng, recorded=None, mixed_types=0.0):
+    """Benchmark all hot-path entry points for one rule count / message length"""
+    from bot_handler import handle_message, handle_button_click
+    from rule_cache import rule_cache, callback_data
+
+    buttons = max(1, rules // 10)
+    bot_id, button_texts, trigger_texts = seed_bot(app, buttons, rules - buttons, rng, mixed_types)
+    messages = synthetic_messages(count, length, button_texts + trigger_texts, hit_rate, rng)
+
+    # Warm the rule cache so steady-state cost is measured; cold load is reported separately
+    rule_cache.invalidate(bot_id)
+    t0 = time.perf_counter()
+    rule_cache.get(app, bot_id)
+    cold_load_ms = round((time.perf_counter() - t0) * 1000, 3)
+
+    if recorded:
+        message_updates = [u for u in recorded if u.message]
+        click_updates = [u for u in recorded if u.callback_query]
+        messages = [u.message.text for u in message_updates]
+    else:
+        message_updates = [SyntheticUpdate(text=text) for text in messages]
+        # Clicks carry button ids, as sent by the bot's inline keyboards
+        click_data = [callback_data(button.id) for button in rule_cache.get(app, bot_id).buttons]
+        click_updates = [SyntheticUpdate(callback_data=rng.choice(click_data)) for _ in range(count)]
+
+    results = {
+        'rules': rules,
+        'message_length': length,
+        'cold_load_ms': cold_load_ms,
+        'get_bot_response': bench_get_bot_response(app, bot_id, messages),
+        'handle_message': bench_async_handler(handle_message, app, bot_id, message_updates, concurrency),
+    }
+    if click_updates:
+        results['handle_button_click'] = bench_async_handler(handle_button_click, app, bot_id, click_updates, concurrency)
+    return results
+
+
+def scenario_key(result):
+    return f"rules={result['rules']},len={result['message_length']}"
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions where p50/p99 grew beyond `tolerance`"""
+    previous = {scenario_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(scenario_key(result))
+        if not old:
+            continue
+        for name in ('get_bot_response', 'handle_message', 'handle_button_click'):
+            if name not in result or name not in old:
+                continue
+            for metric in ('p50_ms', 'p99_ms'):
+                before, after = old[name][metric], result[name][metric]
+                if before and after > before * (1 + tolerance):
+                    regressions.append(
+                        f"{scenario_key(result)} {name} {metric}: {before:.4f} -> {after:.4f} ms "
+                        f"(+{(after / before - 1) * 100:.0f}%)"
+                    )
+    return regressions
+
+
+def print_results(results):
+    print(f"{'scenario':<24} {'entry point':<20} {'p50 ms':>10} {'p99 ms':>10} {'upd/s':>12}")
+    print('-' * 80)
+    for result in results:
+        for name in ('get_bot_response', 'handle_message', 'handle_button_click'):
+            if name in result:
+                stats = result[name]
+                print(f"{scenario_key(result):<24} {name:<20} {stats['p50_ms']:>10.4f} {stats['p99_ms']:>10.4f} {stats['updates_per_sec']:>12.1f}")
+        print(f"{scenario_key(result):<24} {'cold rule load':<20} {result['cold_load_ms']:>10.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bot message handling hot path")
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 100, 1000, 5000], help="rule counts per bot")
+    parser.add_argument('--lengths', type=int, nargs='+', default=[20, 200, 2000], help="message lengths in characters")
+    parser.add_argument('--count', type=int, default=2000, help="updates per scenario")
+    parser.add_argument('--hit-rate', type=float, default=0.5, help="share of messages that contain a rule")
+    parser.add_argument('--concurrency', type=int, default=1, help="updates handled concurrently")
+    parser.add_argument('--mixed-types', type=float, default=0.0, help="share of triggers using word/prefix/regex matching")
+    parser.add_argument('--updates', help="JSON Lines file of recorded Telegram updates to replay")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--save', metavar='NAME', help="save results as benchmarks/NAME.json")
+    parser.add_argument('--compare', metavar='NAME', help="compare against benchmarks/NAME.json")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    recorded = load_recorded_updates(args.updates) if args.updates else None
+    lengths = [0] if recorded else args.lengths
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_benchmark_app(Path(tmp) / 'benchmark.db')
+        for rules in args.rules:
+            for length in lengths:
+                results.append(run_scenario(
+                    app, rules, length, args.count, args.hit_rate, args.concurrency, rng, recorded, args.mixed_types
+                ))
+        with app.app_context():
+            db.engine.dispose()
+
+    print_results(results)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {k: v for k, v in vars(args).items() if k not in ('save', 'compare')},
+        'results': results,
+    }
+
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        path = BASELINE_DIR / f"{args.save}.json"
+        path.write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"\nSaved baseline to {path}")
+
+    if args.compare:
+        path = BASELINE_DIR / f"{args.compare}.json"
+        regressions = compare(results, json.loads(path.read_text(encoding='utf-8')), args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {path}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions against {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,75 +2,192 @@
 Telegram Bot Handler
 Handles polling and message processing for all active bots
 """
+import asyncio
+import functools
+import hashlib
+import hmac
+import logging
+import queue
 import threading
 import time
+from collections import namedtuple
+import httpx
+from telegram import Update
 from telegram.ext import Application, MessageHandler, filters, CallbackQueryHandler
-from models import db, Bot as BotModel, Message, Button
+from telegram.request import HTTPXRequest
+from models import db, Bot as BotModel
 from config import Config
+from rule_cache import rule_cache
+from bot_runtime import bot_runtime
+from send_scheduler import SendScheduler, PRIORITY_CALLBACK
+from response_template import render_response, user_counters
+from analytics import recorder
+from conversation_state import conversation_states
+from bot_startup import ReadinessBot, StartupOrchestrator
+import metrics
 from flask import Flask
 
-# Global dictionary to store bot applications
+logger = logging.getLogger(__name__)
+
+# Global dictionary to store bot applications running on the bot runtime
 bot_applications = {}
-bot_threads = {}
+# Webhook path secret -> bot_id for bots started in webhook mode
+webhook_routes = {}
+# Bot change events for the monitor: (bot_id, restart)
+bot_events = queue.Queue()
+# Optional predicate bot_id -> bool set by bot_runner workers to limit this process to its shard
+bot_shard = None
+_start_lock = threading.Lock()
+
+# Immutable copy of a running bot's settings, kept in bot_data['config'] and
+# replaced as a whole when the bot is edited so handlers never see a mix
+BotConfig = namedtuple('BotConfig', ['id', 'name', 'description', 'token'])
+
+
+def bot_config(bot_model):
+    return BotConfig(bot_model.id, bot_model.name, bot_model.description, bot_model.token)
+
+
+def _collect_receiving():
+    """Per-bot 1/0: the application is running and polling or registered for webhooks"""
+    webhook_bots = set(webhook_routes.values())
+    return [
+        ((str(bot_id),), 1 if application.running and (
+            bot_id in webhook_bots or (application.updater is not None and application.updater.running)
+        ) else 0)
+        for bot_id, application in list(bot_applications.items())
+    ]
+
 
+for _name, _documentation, _collect in (
+    ('bot_active_bots', 'Bots with an application on the runtime', lambda: [((), len(bot_applications))]),
+    ('bot_process_threads', 'Threads alive in this process', lambda: [((), threading.active_count())]),
+    ('bot_runtime_loop_alive', 'Whether the bot runtime event loop thread is alive',
+        lambda: [((), 1 if bot_runtime.is_running() else 0)]),
+    ('bot_runtime_loop_lag_seconds', 'How late the runtime loop ran its last heartbeat',
+        lambda: [((), bot_runtime.loop_lag)]),
+    ('bot_runtime_heartbeat_age_seconds', 'Seconds since the runtime loop last ran its heartbeat; grows when the loop is stalled',
+        lambda: [((), time.time() - bot_runtime.last_heartbeat if bot_runtime.last_heartbeat else 0)]),
+    ('bot_pending_events', 'Bot change events waiting for the monitor', lambda: [((), bot_events.qsize())]),
+):
+    metrics.registry.register(metrics.Gauge(_name, _documentation, collect=_collect))
+metrics.registry.register(metrics.Gauge(
+    'bot_startup_bots', 'Bots of the last startup run by state (queued, starting, ready, failed)', ('state',),
+    collect=lambda: [((state,), count) for state, count in bot_startup.counts().items()]
+))
+metrics.registry.register(metrics.Gauge(
+    'bot_receiving', 'Whether each bot application is running and receiving updates', ('bot_id',),
+    collect=_collect_receiving
+))
+metrics.registry.register(metrics.Gauge(
+    'bot_send_queue_depth', 'Outbound API calls waiting in each bot\'s send scheduler', ('bot_id',),
+    collect=lambda: [
+        ((str(bot_id),), application.bot_data['scheduler'].pending)
+        for bot_id, application in list(bot_applications.items())
+    ]
+))
 
-def get_bot_response(app, bot_id, user_message):
+
+async def load_rules(app, bot_id):
+    """Return a bot's cached rules; a cold load runs in a worker thread
+
+    Loading queries the database and compiles the matcher (tens of ms for
+    a large bot), which would stall every bot on the shared runtime loop.
     """
-    Get the appropriate response for a message based on bot configuration
-    Priority: Buttons first, then auto-reply messages
+    rules = rule_cache.peek(bot_id)
+    if rules is None:
+        rules = await asyncio.get_running_loop().run_in_executor(None, rule_cache.get, app, bot_id)
+    return rules
+
+
+def match_rule(app, bot_id, user_message, state=None, rules=None):
+    """
+    Find the Rule answering a message based on bot configuration
+    Priority: rules for the chat's conversation `state`, then buttons, then auto-reply messages
     """
     try:
-        with app.app_context():
-            # Check buttons first (case-insensitive)
-            buttons = Button.query.filter_by(bot_id=bot_id).all()
-            print(f"DEBUG: Checking {len(buttons)} buttons for bot {bot_id}")
-            for button in buttons:
-                if button.button_text.lower() in user_message.lower():
-                    print(f"DEBUG: Matched button '{button.button_text}' for bot {bot_id}")
-                    return button.response_text
-            
-            # Then check auto-reply messages (case-insensitive)
-            messages = Message.query.filter_by(bot_id=bot_id).all()
-            print(f"DEBUG: Checking {len(messages)} messages for bot {bot_id}")
-            for message in messages:
-                if message.trigger_text.lower() in user_message.lower():
-                    print(f"DEBUG: Matched trigger '{message.trigger_text}' for bot {bot_id}")
-                    return message.response_text
-            
-            print(f"DEBUG: No match found for bot {bot_id}")
-            return None
-    except Exception as e:
-        print(f"ERROR in get_bot_response: {e}")
-        import traceback
-        traceback.print_exc()
+        if rules is None:
+            with metrics.LATENCY.time('rule_lookup'):
+                rules = rule_cache.get(app, bot_id)
+        
+        # Single case-insensitive pass over the message for all rules
+        with metrics.LATENCY.time('match'):
+            rule = rules.match(user_message, state)
+        metrics.MATCHES.inc(str(bot_id), 'hit' if rule else 'miss')
+        if rule:
+            if rule.kind == 'button':
+                logger.debug("Matched button '%s'", rule.text, extra={'bot_id': bot_id})
+            else:
+                logger.debug("Matched trigger '%s'", rule.text, extra={'bot_id': bot_id})
+            return rule
+        
+        logger.debug("No match found", extra={'bot_id': bot_id})
+        return None
+    except Exception:
+        logger.exception("Error in match_rule", extra={'bot_id': bot_id})
         return None
 
 
+def get_bot_response(app, bot_id, user_message, update=None):
+    """
+    Get the appropriate response for a message based on bot configuration
+    Template variables are filled in from `update` when given
+    """
+    rule = match_rule(app, bot_id, user_message)
+    return render_response(rule, update, bot_id) if rule else None
+
+
 async def handle_message(update, context):
     """Handle incoming messages"""
     try:
         bot_id = context.bot_data.get('bot_id')
         app = context.bot_data.get('app')
         if not bot_id or not app:
-            print(f"ERROR: Missing bot_id or app in context. bot_id={bot_id}, app={app}")
+            logger.error("Missing bot_id or app in context. bot_id=%s, app=%s", bot_id, app)
             return
         
         if not update.message or not update.message.text:
             return
         
+        started = time.perf_counter()
+        metrics.UPDATES.inc(str(bot_id), 'message')
+        metrics.LAST_UPDATE.set(time.time(), str(bot_id))
         user_message = update.message.text
-        print(f"DEBUG: Received message for bot {bot_id}: '{user_message}'")
+        logger.debug("Received message: '%s'", user_message, extra={'bot_id': bot_id})
+        user = update.effective_user
+        if user is not None:
+            user_counters.increment(bot_id, user.id)
         
-        response = get_bot_response(app, bot_id, user_message)
+        message = update.message
+        state = conversation_states.get(bot_id, message.chat_id)
+        with metrics.LATENCY.time('rule_lookup'):
+            rules = await load_rules(app, bot_id)
+        rule = match_rule(app, bot_id, user_message, state, rules)
+        if rule:
+            state = conversation_states.advance(bot_id, message.chat_id, rule, state)
+        # Buffered in memory; the analytics flusher writes it out later
+        recorder.record(bot_id, 'message', message.chat_id, user.id if user else None, rule, user_message)
+        response = render_response(rule, update, bot_id) if rule else None
+        match_ms = round((time.perf_counter() - started) * 1000, 3)
         if response:
-            print(f"DEBUG: Sending response for bot {bot_id}: '{response[:50]}...'")
-            await update.message.reply_text(response)
+            logger.debug("Queueing response: '%.50s...'", response, extra={'bot_id': bot_id, 'match_ms': match_ms})
+            # Cached with the rules, so attaching the bot's buttons costs a dict lookup
+            keyboard = rules.keyboard(state)
+            # The scheduler paces the send and logs "Replied to message" once it went out
+            context.bot_data['scheduler'].submit(
+                lambda: message.reply_text(response, reply_markup=keyboard),
+                chat_id=message.chat_id,
+                log_message="Replied to message",
+                started=started
+            )
         else:
-            print(f"DEBUG: No matching trigger found for bot {bot_id}, message: '{user_message}'")
-    except Exception as e:
-        print(f"ERROR in handle_message: {e}")
-        import traceback
-        traceback.print_exc()
+            logger.debug(
+                "No matching trigger found, message: '%s'", user_message,
+                extra={'bot_id': bot_id, 'match_ms': match_ms}
+            )
+    except Exception:
+        metrics.ERRORS.inc(str(context.bot_data.get('bot_id')), 'handle_message')
+        logger.exception("Error in handle_message", extra={'bot_id': context.bot_data.get('bot_id')})
 
 
 async def handle_button_click(update, context):
@@ -79,184 +196,379 @@ async def handle_button_click(update, context):
         bot_id = context.bot_data.get('bot_id')
         app = context.bot_data.get('app')
         if not bot_id or not app:
-            print(f"ERROR: Missing bot_id or app in button handler. bot_id={bot_id}, app={app}")
+            logger.error("Missing bot_id or app in button handler. bot_id=%s, app=%s", bot_id, app)
             return
         
         query = update.callback_query
         if not query:
             return
             
-        button_text = query.data
-        print(f"DEBUG: Received button click for bot {bot_id}: '{button_text}'")
+        started = time.perf_counter()
+        metrics.UPDATES.inc(str(bot_id), 'callback_query')
+        metrics.LAST_UPDATE.set(time.time(), str(bot_id))
+        callback_data = query.data or ''
+        logger.debug("Received button click: '%s'", callback_data, extra={'bot_id': bot_id})
         
-        # Find button by text
-        with app.app_context():
-            button = Button.query.filter_by(bot_id=bot_id, button_text=button_text).first()
-            if button:
-                print(f"DEBUG: Matched button '{button.button_text}' for bot {bot_id}")
-                await query.answer()
-                await query.edit_message_text(text=button.response_text)
-            else:
-                print(f"DEBUG: No button found matching '{button_text}' for bot {bot_id}")
-    except Exception as e:
-        print(f"ERROR in handle_button_click: {e}")
-        import traceback
-        traceback.print_exc()
+        # Find the button by its id (or text, for older keyboards) in the chat's conversation state
+        chat_id = query.message.chat_id if query.message else None
+        state = conversation_states.get(bot_id, chat_id) if chat_id is not None else None
+        with metrics.LATENCY.time('rule_lookup'):
+            rules = await load_rules(app, bot_id)
+        button = rules.button(callback_data, state)
+        metrics.MATCHES.inc(str(bot_id), 'hit' if button else 'miss')
+        if button and chat_id is not None:
+            state = conversation_states.advance(bot_id, chat_id, button, state)
+        recorder.record(bot_id, 'callback', chat_id, query.from_user.id, button, button.text if button else callback_data)
+        if button:
+            logger.debug("Matched button '%s'", button.text, extra={'bot_id': bot_id})
+            scheduler = context.bot_data['scheduler']
+            # Stop the client's loading spinner before any queued messages go out
+            scheduler.submit(query.answer, priority=PRIORITY_CALLBACK, counted=False)
+            response = render_response(button, update, bot_id)
+            keyboard = rules.keyboard(state)
+            scheduler.submit(
+                lambda: query.edit_message_text(text=response, reply_markup=keyboard),
+                chat_id=chat_id,
+                log_message="Answered button click",
+                started=started
+            )
+        else:
+            logger.debug("No button found matching '%s'", callback_data, extra={'bot_id': bot_id})
+    except Exception:
+        metrics.ERRORS.inc(str(context.bot_data.get('bot_id')), 'handle_button_click')
+        logger.exception("Error in handle_button_click", extra={'bot_id': context.bot_data.get('bot_id')})
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context():
+    """Certificate-verifying SSL context shared by every bot's HTTP clients"""
+    return httpx.create_ssl_context()
+
+
+def on_bot_ready(bot_id, started):
+    """Called on the runtime loop when a bot first receives updates"""
+    logger.info("Bot ready after %.2fs", time.monotonic() - started, extra={'bot_id': bot_id})
+    bot_startup.mark_ready(bot_id)
 
 
 def create_bot_application(bot_model, app):
     """Create a Telegram bot application for a bot model"""
     try:
-        print(f"DEBUG: Creating application for bot {bot_model.name} (ID: {bot_model.id})")
-        application = Application.builder().token(bot_model.token).build()
+        logger.debug("Creating application for bot %s", bot_model.name, extra={'bot_id': bot_model.id})
+        bot_id = bot_model.id
+        started = time.monotonic()
+        # Same requests the default builder makes, but sharing one SSL context:
+        # building a context per client costs ~35 ms and dominated startup
+        bot = ReadinessBot(
+            bot_model.token,
+            base_url=Config.TELEGRAM_API_URL,
+            request=HTTPXRequest(connection_pool_size=256, httpx_kwargs={'verify': _ssl_context()}),
+            get_updates_request=HTTPXRequest(connection_pool_size=1, httpx_kwargs={'verify': _ssl_context()}),
+            on_ready=lambda: on_bot_ready(bot_id, started),
+        )
+        application = Application.builder().bot(bot).build()
         
         # Store bot_id and app in bot_data for handlers
         application.bot_data['bot_id'] = bot_model.id
         application.bot_data['app'] = app
+        application.bot_data['config'] = bot_config(bot_model)
+        application.bot_data['scheduler'] = SendScheduler(bot_model.id)
+        # Events and conversation state snapshots are written by background threads wherever bots run
+        recorder.start(app)
+        conversation_states.start(app)
+        conversation_states.restore(app, bot_model.id)
         
         # Add handlers - make sure they're added before starting
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
         application.add_handler(CallbackQueryHandler(handle_button_click))
         
-        print(f"DEBUG: Application created successfully for bot {bot_model.name}")
-        print(f"DEBUG: Handlers added - MessageHandler and CallbackQueryHandler")
+        logger.debug("Application created with MessageHandler and CallbackQueryHandler", extra={'bot_id': bot_model.id})
         return application
-    except Exception as e:
-        print(f"ERROR: Error creating bot application for {bot_model.name}: {e}")
-        print(f"  Token: {bot_model.token[:10]}... (truncated for security)")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception(
+            "Error creating bot application for %s (token %s...)", bot_model.name, bot_model.token[:10],
+            extra={'bot_id': bot_model.id}
+        )
         return None
 
 
-def run_bot_polling(bot_id, application):
-    """Run polling for a bot in a separate thread"""
-    import asyncio
-    try:
-        print(f"DEBUG: Starting polling for bot {bot_id}")
-        # Create a new event loop for this thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        # Use run_polling which handles initialization automatically for v20.x
-        application.run_polling(
-            allowed_updates=["message", "callback_query"],
-            drop_pending_updates=True,
-            stop_signals=None  # Don't handle signals in thread
-        )
-        print(f"DEBUG: Polling started successfully for bot {bot_id}")
-    except Exception as e:
-        print(f"ERROR: Error in polling for bot {bot_id}: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        try:
-            loop.close()
-        except:
-            pass
+def webhook_secret(token, purpose='path'):
+    """Derive a stable per-bot webhook secret from the bot token"""
+    key = Config.SECRET_KEY.encode('utf-8')
+    return hmac.new(key, f"{purpose}:{token}".encode('utf-8'), hashlib.sha256).hexdigest()[:48]
 
 
-def start_bot(bot_model, app):
-    """Start a bot's polling"""
-    if bot_model.id in bot_applications:
-        # Bot already running
-        print(f"Bot {bot_model.name} (ID: {bot_model.id}) is already running")
-        return
-    
-    if not bot_model.is_active:
-        print(f"Bot {bot_model.name} (ID: {bot_model.id}) is not active, skipping start")
-        return
+def use_webhooks():
+    """Check whether bots should receive updates through the webhook endpoint"""
+    if Config.BOT_UPDATE_MODE != 'webhook':
+        return False
+    if not Config.WEBHOOK_BASE_URL:
+        logger.warning("BOT_UPDATE_MODE is 'webhook' but WEBHOOK_BASE_URL is not set, falling back to polling")
+        return False
+    return True
+
+
+def dispatch_webhook_update(bot_id, path_secret, header_secret, payload):
+    """Route a webhook update to the bot it belongs to, returns False if unknown"""
+    if Config.BOT_RUNNER == 'external':
+        # Sent only to the worker that owns the bot, which checks the secrets
+        from bot_runner import send_command
+        return bool(send_command({
+            'type': 'webhook', 'bot_id': bot_id, 'secret': path_secret, 'header': header_secret, 'payload': payload
+        }))
     
-    print(f"Attempting to start bot: {bot_model.name} (ID: {bot_model.id})")
-    print(f"  Token: {bot_model.token[:15]}... (truncated)")
-    print(f"  Active: {bot_model.is_active}")
+    if webhook_routes.get(path_secret) != bot_id:
+        return False
+    application = bot_applications.get(bot_id)
+    if application is None or not payload:
+        return False
     
-    application = create_bot_application(bot_model, app)
-    if not application:
-        print(f"ERROR: Failed to create bot application for {bot_model.name}")
-        return
+    if not hmac.compare_digest(header_secret or '', webhook_secret(application.bot.token, 'header')):
+        logger.warning("Rejected webhook update with bad secret token", extra={'bot_id': bot_id})
+        return False
     
-    bot_applications[bot_model.id] = application
+    update = Update.de_json(payload, application.bot)
+    bot_runtime.put_update(application, update)
+    return True
+
+
+def start_bot(bot_model, app):
+    """Start a bot's polling on the shared bot runtime
+
+    Returns a future that resolves once the application is running, or
+    None if the bot was not started. The bot reports itself ready after
+    its first successful getUpdates.
+    """
+    # The startup orchestrator, the monitor and panel events may start bots concurrently
+    with _start_lock:
+        if bot_model.id in bot_applications:
+            # Bot already running
+            logger.info("Bot %s is already running", bot_model.name, extra={'bot_id': bot_model.id})
+            return
+        
+        if not bot_model.is_active:
+            logger.info("Bot %s is not active, skipping start", bot_model.name, extra={'bot_id': bot_model.id})
+            return
+        
+        logger.info("Attempting to start bot: %s (token %s...)", bot_model.name, bot_model.token[:15], extra={'bot_id': bot_model.id})
+        
+        application = create_bot_application(bot_model, app)
+        if not application:
+            logger.error("Failed to create bot application for %s", bot_model.name, extra={'bot_id': bot_model.id})
+            return
+        
+        bot_id = bot_model.id
+        bot_name = bot_model.name
+        bot_applications[bot_id] = application
     
-    # Start polling in a separate thread
-    thread = threading.Thread(
-        target=run_bot_polling,
-        args=(bot_model.id, application),
-        daemon=True,
-        name=f"BotPolling-{bot_model.id}"
-    )
-    thread.start()
-    bot_threads[bot_model.id] = thread
+    # Compile the rules in this thread, outside the start lock and off the
+    # runtime loop, so the first update doesn't stall every bot on the loop
+    try:
+        rule_cache.get(app, bot_id)
+    except Exception:
+        logger.exception("Error prewarming rule cache", extra={'bot_id': bot_id})
     
-    # Give the thread a moment to start
-    import time
-    time.sleep(1)  # Increased wait time
+    def on_started(future):
+        error = future.exception()
+        if error is None:
+            logger.info("Started bot: %s - Receiving updates", bot_name, extra={'bot_id': bot_id})
+            if is_webhook:
+                # No getUpdates in webhook mode; registering the webhook is the readiness signal
+                application.bot.mark_ready()
+            return
+        logger.error("Error starting bot: %s", error, extra={'bot_id': bot_id})
+        # Forget the failed application so the monitor can retry it later
+        if bot_applications.get(bot_id) is application:
+            del bot_applications[bot_id]
+            webhook_routes.pop(webhook_secret(application.bot.token), None)
     
-    if thread.is_alive():
-        print(f"SUCCESS: Started bot: {bot_model.name} (ID: {bot_model.id}) - Polling active")
-        print(f"  Thread ID: {thread.ident}")
-        print(f"  Thread name: {thread.name}")
-        print(f"  Thread alive: {thread.is_alive()}")
+    is_webhook = use_webhooks()
+    if is_webhook:
+        path_secret = webhook_secret(bot_model.token)
+        webhook_routes[path_secret] = bot_id
+        future = bot_runtime.start_webhook_application(
+            bot_id,
+            application,
+            url=f"{Config.WEBHOOK_BASE_URL.rstrip('/')}/telegram/webhook/{bot_id}/{path_secret}",
+            secret_token=webhook_secret(bot_model.token, 'header'),
+            allowed_updates=["message", "callback_query"],
+            drop_pending_updates=True
+        )
     else:
-        print(f"WARNING: Thread for bot {bot_model.name} (ID: {bot_model.id}) may have failed to start")
+        future = bot_runtime.start_application(
+            bot_id,
+            application,
+            allowed_updates=["message", "callback_query"],
+            drop_pending_updates=True
+        )
+    future.add_done_callback(on_started)
+    return future
+
+
+# Starts the bots of initialize_bots; on_bot_ready reports back to it
+bot_startup = StartupOrchestrator(start_bot, Config.BOT_STARTUP_CONCURRENCY)
 
 
 def stop_bot(bot_id):
-    """Stop a bot's polling"""
-    if bot_id in bot_applications:
-        try:
-            print(f"Stopping bot ID: {bot_id}")
-            application = bot_applications[bot_id]
-            
-            # Stop the updater if it's running
-            if hasattr(application, 'updater') and hasattr(application.updater, 'running') and application.updater.running:
-                application.updater.stop()
-                print(f"  Stopped updater for bot {bot_id}")
-            
-            # Stop and shutdown the application
-            application.stop()
-            application.shutdown()
-            
-            del bot_applications[bot_id]
-            if bot_id in bot_threads:
-                del bot_threads[bot_id]
-            print(f"SUCCESS: Stopped bot ID: {bot_id}")
-        except Exception as e:
-            print(f"ERROR: Error stopping bot {bot_id}: {e}")
-            import traceback
-            traceback.print_exc()
+    """Stop a bot's polling, draining in-flight updates and replies on the runtime loop"""
+    application = bot_applications.pop(bot_id, None)
+    if application is None:
+        return
+    metrics.LAST_UPDATE.remove(str(bot_id))
+    
+    logger.info("Stopping bot", extra={'bot_id': bot_id})
+    path_secret = webhook_secret(application.bot.token)
+    is_webhook = webhook_routes.pop(path_secret, None) is not None
+    
+    def on_stopped(future):
+        error = future.exception()
+        if error is None:
+            logger.info("Stopped bot", extra={'bot_id': bot_id})
+        else:
+            logger.error("Error stopping bot: %s", error, extra={'bot_id': bot_id})
+    
+    # Stop runs on the runtime loop, after any pending start of the same bot:
+    # updates already received are handled and their replies sent before shutdown
+    future = bot_runtime.stop_application(
+        bot_id, application, delete_webhook=is_webhook, drain=application.bot_data['scheduler'].drain
+    )
+    future.add_done_callback(on_stopped)
+    return future
 
 
 def update_bot_statuses(app):
     """Update bot statuses - start active bots, stop inactive ones"""
-    with app.app_context():
+    with metrics.RECONCILE.time('full'), app.app_context():
         # Get all bots
         all_bots = BotModel.query.all()
         
-        # Start active bots that aren't running
+        # Start active bots that aren't running and refresh the ones that are
         for bot in all_bots:
-            if bot.is_active and bot.id not in bot_applications:
+            should_run = bot.is_active and owns_bot(bot.id)
+            if should_run and bot.id not in bot_applications:
+                start_bot(bot, app)
+            elif should_run and not refresh_bot(bot):
+                stop_bot(bot.id)
                 start_bot(bot, app)
-            elif not bot.is_active and bot.id in bot_applications:
+            elif not should_run and bot.id in bot_applications:
                 stop_bot(bot.id)
+        
+        # Stop bots that were deleted
+        known_ids = {bot.id for bot in all_bots}
+        for bot_id in list(bot_applications):
+            if bot_id not in known_ids:
+                stop_bot(bot_id)
 
 
-def initialize_bots(app):
-    """Initialize all active bots on startup"""
-    with app.app_context():
-        active_bots = BotModel.query.filter_by(is_active=True).all()
-        for bot in active_bots:
+def refresh_bot(bot_model):
+    """Swap a running bot's config snapshot in place, returns False if it needs a restart
+
+    Only a token change needs a new Application; anything else is picked
+    up by the running bot without interrupting polling.
+    """
+    application = bot_applications.get(bot_model.id)
+    if application is None:
+        return False
+    config = application.bot_data['config']
+    if config.token != bot_model.token:
+        return False
+    new_config = bot_config(bot_model)
+    if new_config != config:
+        # One reference assignment, so handlers see either snapshot whole
+        application.bot_data['config'] = new_config
+        logger.info("Reloaded bot settings without restarting", extra={'bot_id': bot_model.id})
+    return True
+
+
+def owns_bot(bot_id):
+    """Check whether this process is responsible for running a bot"""
+    return bot_shard is None or bot_shard(bot_id)
+
+
+def notify_bot_changed(bot_id, restart=False):
+    """Tell the bot monitor that a bot was created, toggled, edited or deleted
+
+    A bot_id of None triggers a full resync of every bot.
+    """
+    if Config.BOT_RUNNER == 'external':
+        # Bots run under bot_runner.py; hand the event to its supervisor
+        from bot_runner import send_command
+        send_command({'type': 'changed', 'bot_id': bot_id, 'restart': restart})
+        return
+    bot_events.put((bot_id, restart))
+
+
+def notify_rules_changed(bot_id):
+    """Swap in a bot's new rules after its messages or buttons changed"""
+    application = bot_applications.get(bot_id)
+    if application is None:
+        rule_cache.invalidate(bot_id)
+    else:
+        # Compile here so the running bot keeps answering from the old
+        # snapshot instead of waiting on the database in its handler
+        try:
+            rule_cache.reload(application.bot_data['app'], bot_id)
+        except Exception:
+            logger.exception("Error reloading rules", extra={'bot_id': bot_id})
+    if Config.BOT_RUNNER == 'external':
+        from bot_runner import send_command
+        send_command({'type': 'rules', 'bot_id': bot_id})
+
+
+def reconcile_bot(app, bot_id, restart=False):
+    """Bring one bot's runtime state in line with the database
+
+    A running bot is only restarted when its token changed or `restart`
+    is set; other edits are hot-swapped by refresh_bot.
+    """
+    with metrics.RECONCILE.time('event'), app.app_context():
+        bot = db.session.get(BotModel, bot_id)
+        should_run = bot is not None and bot.is_active and owns_bot(bot_id)
+        if should_run and not restart and refresh_bot(bot):
+            return
+        if bot_id in bot_applications:
+            stop_bot(bot_id)
+        if should_run:
             start_bot(bot, app)
-        print(f"Initialized {len(active_bots)} active bot(s)")
+
+
+def initialize_bots(app):
+    """Start all active bots in the background, busiest first, and return at once"""
+    def load_bots():
+        return [bot for bot in BotModel.query.filter_by(is_active=True).all() if owns_bot(bot.id)]
+    
+    return bot_startup.start_all(app, load_bots)
 
 
 def monitor_bots(app):
-    """Monitor bot statuses periodically"""
+    """Apply bot change events as they arrive, with a slow full resync as a safety net"""
+    last_resync = time.monotonic()
     while True:
         try:
-            time.sleep(10)  # Check every 10 seconds
-            update_bot_statuses(app)
-        except Exception as e:
-            print(f"Error in bot monitor: {e}")
+            timeout = max(0, Config.BOT_RESYNC_INTERVAL - (time.monotonic() - last_resync))
+            try:
+                bot_id, restart = bot_events.get(timeout=timeout)
+            except queue.Empty:
+                update_bot_statuses(app)
+                last_resync = time.monotonic()
+                continue
+            
+            # Coalesce a burst of events into one reconcile per bot
+            pending = {bot_id: restart}
+            while True:
+                try:
+                    bot_id, restart = bot_events.get_nowait()
+                except queue.Empty:
+                    break
+                pending[bot_id] = pending.get(bot_id, False) or restart
+            
+            # A None bot_id asks for a full resync, e.g. after this process's shard changed
+            if pending.pop(None, None) is not None:
+                update_bot_statuses(app)
+                last_resync = time.monotonic()
+            
+            for bot_id, restart in pending.items():
+                reconcile_bot(app, bot_id, restart)
+        except Exception:
+            logger.exception("Error in bot monitor")
             time.sleep(30)  # Wait longer on error
-
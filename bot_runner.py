@@ -0,0 +1,412 @@
+"""
+Bot Runner - Run bots in worker processes outside the web panel
+Splits active bots across N worker processes by stable hashing of
+bot_id. A supervisor restarts crashed workers and routes start/stop
+commands from the panel to the worker that owns each bot.
+
+Usage:
+    python bot_runner.py --workers 4          # run the supervisor and workers
+    python bot_runner.py --status             # show workers of a running supervisor
+    python bot_runner.py --resize 6           # change the worker count and rebalance
+    then run the panel with BOT_RUNNER=external
+"""
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import hashlib
+import logging
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Client, AuthenticationError, deliver_challenge, answer_challenge
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds before restarting a crashed worker, doubling per crash up to the max
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 60.0
+# A worker that stayed up this long has its backoff reset
+STABLE_AFTER = 60.0
+# Largest command or reply accepted on the control channel
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+MIN_SECRET_LENGTH = 16
+
+
+class BotRunnerConfigError(RuntimeError):
+    """BOT_RUNNER_SECRET is missing or unsafe"""
+
+
+def shard_for(bot_id, workers):
+    """Pick the worker index for a bot by rendezvous hashing
+
+    Every process computes the same owner, and changing the worker count
+    only moves the bots whose highest-scoring worker changed.
+    """
+    return max(range(workers), key=lambda index: hashlib.sha1(f"{index}:{bot_id}".encode()).digest())
+
+
+def _address():
+    return (Config.BOT_RUNNER_HOST, Config.BOT_RUNNER_PORT)
+
+
+def authkey():
+    """Key for the control channel's HMAC handshake, from BOT_RUNNER_SECRET
+
+    Whoever holds it can start and stop bots, so it must not fall back to
+    SECRET_KEY, which has a public default.
+    """
+    secret = Config.BOT_RUNNER_SECRET
+    if not secret:
+        raise BotRunnerConfigError("BOT_RUNNER_SECRET is not set")
+    if len(secret) < MIN_SECRET_LENGTH:
+        raise BotRunnerConfigError(f"BOT_RUNNER_SECRET must be at least {MIN_SECRET_LENGTH} characters")
+    if secret == Config.SECRET_KEY:
+        raise BotRunnerConfigError("BOT_RUNNER_SECRET must differ from SECRET_KEY")
+    return hashlib.sha256(f"bot-runner:{secret}".encode()).digest()
+
+
+def _send(connection, message):
+    # JSON rather than Connection.send(), which pickles
+    connection.send_bytes(json.dumps(message).encode('utf-8'))
+
+
+def _recv(connection):
+    return json.loads(connection.recv_bytes(MAX_MESSAGE_SIZE))
+
+
+# ---------------------------------------------------------------------------
+# Worker process
+# ---------------------------------------------------------------------------
+
+def run_worker(index, workers, commands):
+    """Run the bots of one shard until told to stop or the supervisor dies"""
+    from flask import Flask
+    from models import db
+    from setup_logging import setup_logging, worker_log_file
+    import bot_handler
+    from bot_runtime import bot_runtime
+    from analytics import recorder
+
+    setup_logging(log_file=worker_log_file(index))
+    # Bots run in this process, so events and webhooks are handled locally
+    Config.BOT_RUNNER = 'embedded'
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+
+    def set_shard(count):
+        bot_handler.bot_shard = lambda bot_id: shard_for(bot_id, count) == index
+
+    set_shard(workers)
+    bot_handler.initialize_bots(app)
+    threading.Thread(target=bot_handler.monitor_bots, args=(app,), daemon=True, name="BotMonitor").start()
+    logger.info("Bot runner worker %d of %d started (pid %d)", index, workers, os.getpid())
+
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            command = commands.get(timeout=5)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                logger.warning("Supervisor is gone, stopping worker %d", index)
+                break
+            continue
+
+        kind = command['type']
+        if kind == 'stop':
+            break
+        try:
+            if kind == 'changed':
+                bot_handler.notify_bot_changed(command['bot_id'], command.get('restart', False))
+            elif kind == 'rules':
+                bot_handler.notify_rules_changed(command['bot_id'])
+            elif kind == 'webhook':
+                bot_handler.dispatch_webhook_update(
+                    command['bot_id'], command['secret'], command['header'], command['payload']
+                )
+            elif kind == 'shard':
+                set_shard(command['workers'])
+                bot_handler.notify_bot_changed(None)
+                logger.info("Worker %d now owns shard %d of %d", index, index, command['workers'])
+        except Exception:
+            logger.exception("Error handling bot runner command %s", kind)
+
+    bot_runtime.shutdown(dict(bot_handler.bot_applications))
+    recorder.flush()
+    logger.info("Bot runner worker %d stopped", index)
+
+
+# ---------------------------------------------------------------------------
+# Supervisor
+# ---------------------------------------------------------------------------
+
+class WorkerHandle:
+    """A worker process, its command queue and restart bookkeeping"""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.commands = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = RESTART_BACKOFF
+        self.restart_at = None
+
+
+class Supervisor:
+    """Own the worker processes and route panel commands to them"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.context = multiprocessing.get_context('spawn')
+        self.handles = {}
+        self._lock = threading.RLock()
+        self._stopping = threading.Event()
+
+    def start_worker(self, handle):
+        handle.commands = self.context.Queue()
+        handle.process = self.context.Process(
+            target=run_worker,
+            args=(handle.index, self.workers, handle.commands),
+            name=f"BotWorker-{handle.index}",
+            daemon=True,
+        )
+        handle.process.start()
+        handle.started_at = time.monotonic()
+        handle.restart_at = None
+        logger.info("Started bot worker %d (pid %d)", handle.index, handle.process.pid)
+
+    def stop_worker(self, handle, timeout=30):
+        if handle.process is None or not handle.process.is_alive():
+            return
+        handle.commands.put({'type': 'stop'})
+        handle.process.join(timeout)
+        if handle.process.is_alive():
+            logger.warning("Bot worker %d did not stop in time, terminating", handle.index)
+            handle.process.terminate()
+            handle.process.join(5)
+
+    def send(self, index, command):
+        handle = self.handles.get(index)
+        if handle and handle.process and handle.process.is_alive():
+            handle.commands.put(command)
+            return True
+        # A restarted worker resyncs from the database, so nothing is lost
+        return False
+
+    def handle_command(self, command):
+        """Execute a panel command, returning the reply sent back to the client"""
+        kind = command.get('type')
+        with self._lock:
+            if kind in ('changed', 'rules'):
+                index = shard_for(command['bot_id'], self.workers)
+                self.send(index, command)
+                return True
+            if kind == 'webhook':
+                # The owner checks the secrets and handles the update
+                return self.send(shard_for(command['bot_id'], self.workers), command)
+            if kind == 'resize':
+                self.resize(int(command['workers']))
+                return True
+            if kind == 'status':
+                return self.status()
+        logger.warning("Unknown bot runner command: %r", kind)
+        return False
+
+    def resize(self, workers):
+        """Change the worker count; each bot moves to its new owner"""
+        if workers < 1 or workers == self.workers:
+            return
+        logger.info("Resizing bot runner from %d to %d worker(s)", self.workers, workers)
+        previous, self.workers = self.workers, workers
+
+        # Stop removed workers first so their bots aren't polled twice
+        for index in range(workers, previous):
+            self.stop_worker(self.handles.pop(index))
+        for index in range(min(workers, previous)):
+            self.send(index, {'type': 'shard', 'workers': workers})
+        for index in range(previous, workers):
+            self.handles[index] = WorkerHandle(index)
+            self.start_worker(self.handles[index])
+
+    def status(self):
+        return {
+            'workers': self.workers,
+            'processes': [
+                {
+                    'index': handle.index,
+                    'pid': handle.process.pid if handle.process else None,
+                    'alive': bool(handle.process and handle.process.is_alive()),
+                    'restarts': handle.restarts,
+                }
+                for handle in self.handles.values()
+            ],
+        }
+
+    def check_workers(self):
+        """Restart dead workers, backing off when one keeps crashing"""
+        now = time.monotonic()
+        with self._lock:
+            for handle in self.handles.values():
+                if handle.process.is_alive():
+                    if now - handle.started_at > STABLE_AFTER:
+                        handle.backoff = RESTART_BACKOFF
+                    continue
+                if handle.restart_at is None:
+                    handle.restart_at = now + handle.backoff
+                    logger.error(
+                        "Bot worker %d exited with code %s, restarting in %.0fs",
+                        handle.index, handle.process.exitcode, handle.backoff
+                    )
+                    handle.backoff = min(handle.backoff * 2, MAX_RESTART_BACKOFF)
+                elif now >= handle.restart_at:
+                    handle.restarts += 1
+                    self.start_worker(handle)
+
+    def serve(self, listener):
+        while not self._stopping.is_set():
+            try:
+                connection = listener.accept()
+            except OSError:
+                if self._stopping.is_set():
+                    break
+                logger.exception("Error accepting bot runner connection")
+                continue
+            threading.Thread(target=self.serve_connection, args=(connection,), daemon=True).start()
+
+    def serve_connection(self, connection):
+        with connection:
+            # Authenticate here rather than in Listener.accept(), so a client that
+            # stalls or drops mid-handshake doesn't block or kill the accept loop
+            try:
+                key = authkey()
+                deliver_challenge(connection, key)
+                answer_challenge(connection, key)
+            except (AuthenticationError, EOFError, OSError) as e:
+                logger.warning("Rejected bot runner connection: %s", e or type(e).__name__)
+                return
+            while True:
+                try:
+                    command = _recv(connection)
+                except (EOFError, OSError):
+                    return
+                except ValueError:
+                    logger.warning("Closing bot runner connection after a malformed command")
+                    return
+                try:
+                    reply = self.handle_command(command)
+                except Exception:
+                    logger.exception("Error handling bot runner command")
+                    reply = False
+                _send(connection, reply)
+
+    def run(self):
+        listener = Listener(_address())
+        logger.info("Bot runner listening on %s:%d with %d worker(s)", *_address(), self.workers)
+
+        with self._lock:
+            for index in range(self.workers):
+                self.handles[index] = WorkerHandle(index)
+                self.start_worker(self.handles[index])
+        threading.Thread(target=self.serve, args=(listener,), daemon=True, name="BotRunnerListener").start()
+
+        signal.signal(signal.SIGTERM, lambda *args: self._stopping.set())
+        try:
+            while not self._stopping.wait(1.0):
+                self.check_workers()
+        except KeyboardInterrupt:
+            self._stopping.set()
+        finally:
+            listener.close()
+            with self._lock:
+                for handle in self.handles.values():
+                    self.stop_worker(handle)
+            logger.info("Bot runner stopped")
+
+
+# ---------------------------------------------------------------------------
+# Panel-side client
+# ---------------------------------------------------------------------------
+
+# One connection per panel thread, so concurrent requests (webhooks in
+# particular) don't queue behind each other's round trips
+_clients = threading.local()
+
+
+def send_command(command):
+    """Send a command to the supervisor, returns its reply or None if unreachable
+
+    The calling thread's connection is kept open and re-established once
+    if it broke.
+    """
+    try:
+        key = authkey()
+    except BotRunnerConfigError as e:
+        logger.error("Not sending bot runner command: %s", e)
+        return None
+    for attempt in range(2):
+        client = getattr(_clients, 'connection', None)
+        try:
+            if client is None:
+                client = _clients.connection = Client(_address(), authkey=key)
+            _send(client, command)
+            return _recv(client)
+        except (OSError, EOFError, AuthenticationError) as e:
+            if client is not None:
+                client.close()
+                _clients.connection = None
+            error = e
+    # Workers still pick the change up on their next full resync
+    logger.warning("Bot runner unreachable at %s:%d: %s", *_address(), error)
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run bots in supervised worker processes")
+    parser.add_argument('--workers', type=int, default=Config.BOT_RUNNER_WORKERS, help="number of worker processes")
+    parser.add_argument('--status', action='store_true', help="show the workers of a running supervisor")
+    parser.add_argument('--resize', type=int, metavar='N', help="change the worker count of a running supervisor")
+    args = parser.parse_args(argv)
+
+    try:
+        authkey()
+    except BotRunnerConfigError as e:
+        print(f"Refusing to start: {e}. Set a random BOT_RUNNER_SECRET shared by the panel and bot_runner.py")
+        return 2
+
+    if args.status or args.resize:
+        reply = send_command({'type': 'resize', 'workers': args.resize} if args.resize else {'type': 'status'})
+        if reply is None:
+            print(f"Bot runner is not reachable at {Config.BOT_RUNNER_HOST}:{Config.BOT_RUNNER_PORT}")
+            return 1
+        if args.status:
+            print(f"{reply['workers']} worker(s)")
+            for process in reply['processes']:
+                state = 'alive' if process['alive'] else 'dead'
+                print(f"  worker {process['index']}: pid {process['pid']} {state}, {process['restarts']} restart(s)")
+        return 0
+
+    from setup_logging import setup_logging
+    from migrations import run_migrations
+    from flask import Flask
+    from models import db
+
+    setup_logging()
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    run_migrations(app)
+    with app.app_context():
+        db.engine.dispose()
+
+    Supervisor(max(1, args.workers)).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
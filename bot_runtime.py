@@ -0,0 +1,172 @@
+"""
+Bot Runtime
+Hosts every active bot Application as tasks on one shared asyncio event loop
+"""
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BotRuntime:
+    """Single background event loop that runs all bot applications
+
+    The start/stop methods can be called from any thread (e.g. Flask
+    request handlers); the actual work is scheduled on the runtime loop
+    and serialized per bot so a stop never races a pending start.
+    """
+
+    def __init__(self, name='BotRuntime'):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # Per-bot asyncio locks, only touched from the runtime loop
+        self._bot_locks = {}
+        # Updated by a heartbeat on the loop; a stale value means the loop is blocked
+        self.last_heartbeat = None
+        self.loop_lag = 0.0
+
+    @property
+    def loop(self):
+        """Return the runtime loop, starting its thread on first use"""
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                thread = threading.Thread(
+                    target=self._run_loop,
+                    args=(loop, ready),
+                    daemon=True,
+                    name=self.name
+                )
+                thread.start()
+                ready.wait()
+                self._loop = loop
+                self._thread = thread
+            return self._loop
+
+    @property
+    def thread(self):
+        return self._thread
+
+    def is_running(self):
+        """Check whether the runtime loop thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run_loop(self, loop, ready):
+        """Run the event loop forever in the runtime thread"""
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.call_soon(self._heartbeat, loop, loop.time())
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def _heartbeat(self, loop, expected, interval=1.0):
+        """Record how late the loop runs scheduled callbacks"""
+        self.loop_lag = max(0.0, loop.time() - expected)
+        self.last_heartbeat = time.time()
+        loop.call_later(interval, self._heartbeat, loop, loop.time() + interval, interval)
+
+    def submit(self, coro):
+        """Schedule a coroutine on the runtime loop and return a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the runtime loop and wait for its result"""
+        return self.submit(coro).result(timeout)
+
+    def _bot_lock(self, bot_id):
+        lock = self._bot_locks.get(bot_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._bot_locks[bot_id] = lock
+        return lock
+
+    def start_application(self, bot_id, application, **polling_kwargs):
+        """Initialize an application and start polling it on the runtime loop"""
+        return self.submit(self._start_application(bot_id, application, polling_kwargs))
+
+    def start_webhook_application(self, bot_id, application, **webhook_kwargs):
+        """Initialize an application and register its webhook on the runtime loop"""
+        return self.submit(self._start_webhook_application(bot_id, application, webhook_kwargs))
+
+    def stop_application(self, bot_id, application, delete_webhook=False, drain=None):
+        """Stop polling and shut down an application on the runtime loop
+
+        Updates already received are still handled; `drain` is an optional
+        coroutine function awaited after that and before the shutdown, e.g.
+        to let queued replies go out.
+        """
+        return self.submit(self._stop_application(bot_id, application, delete_webhook, drain))
+
+    def put_update(self, application, update):
+        """Queue an update for an application started in webhook mode"""
+        self.loop.call_soon_threadsafe(application.update_queue.put_nowait, update)
+
+    async def _start_application(self, bot_id, application, polling_kwargs):
+        async with self._bot_lock(bot_id):
+            try:
+                await application.initialize()
+                await application.updater.start_polling(**polling_kwargs)
+                await application.start()
+            except Exception:
+                await self._shutdown_application(application)
+                raise
+
+    async def _start_webhook_application(self, bot_id, application, webhook_kwargs):
+        async with self._bot_lock(bot_id):
+            try:
+                await application.initialize()
+                await application.start()
+                await application.bot.set_webhook(**webhook_kwargs)
+            except Exception:
+                await self._shutdown_application(application)
+                raise
+
+    async def _stop_application(self, bot_id, application, delete_webhook, drain):
+        async with self._bot_lock(bot_id):
+            if delete_webhook:
+                try:
+                    await application.bot.delete_webhook()
+                except Exception as e:
+                    logger.error("Could not delete webhook: %s", e, extra={'bot_id': bot_id})
+            await self._shutdown_application(application, drain)
+
+    async def _shutdown_application(self, application, drain=None):
+        """Stop whatever parts of an application are running
+
+        Fetching stops first; Application.stop then handles the updates
+        already queued before `drain` runs and the bot is shut down.
+        """
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        if drain is not None:
+            try:
+                await drain()
+            except Exception as e:
+                logger.error("Error draining application: %s", e)
+        await application.shutdown()
+
+    def shutdown(self, applications, timeout=30):
+        """Stop the given applications and then the runtime loop"""
+        if not self.is_running():
+            return
+        futures = [self.stop_application(bot_id, application) for bot_id, application in applications.items()]
+        for future in futures:
+            try:
+                future.result(timeout)
+            except Exception as e:
+                logger.error("Error stopping application during runtime shutdown: %s", e)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+
+# Global runtime shared by all bots in this process
+bot_runtime = BotRuntime()
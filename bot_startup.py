@@ -0,0 +1,174 @@
+"""
+Bot Startup
+Starts every active bot from a background thread with bounded
+parallelism, busiest bots first, and treats a bot as up once its first
+getUpdates succeeds instead of after a fixed delay
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from telegram.ext import ExtBot
+from models import db, TriggerHourlyHits
+
+logger = logging.getLogger(__name__)
+
+# Days of analytics used to order startup
+TRAFFIC_WINDOW_DAYS = 7
+# Longest a bot holds a startup slot waiting to become ready
+READY_TIMEOUT = 30.0
+
+# 'skipped' bots were already running, no longer active or could not be created
+STATES = ('queued', 'starting', 'ready', 'failed', 'skipped')
+
+
+class ReadinessBot(ExtBot):
+    """ExtBot that reports its first successful getUpdates
+
+    That first poll is sent with timeout=0 so it returns at once even when
+    nothing is pending; later polls long-poll as configured.
+    """
+
+    __slots__ = ('on_ready', 'ready')
+
+    def __init__(self, *args, on_ready=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self.on_ready = on_ready
+            self.ready = False
+
+    async def get_updates(self, *args, **kwargs):
+        if self.ready:
+            return await super().get_updates(*args, **kwargs)
+        kwargs['timeout'] = 0
+        updates = await super().get_updates(*args, **kwargs)
+        self.mark_ready()
+        return updates
+
+    def mark_ready(self):
+        if self.ready:
+            return
+        with self._unfrozen():
+            self.ready = True
+        if self.on_ready is not None:
+            self.on_ready()
+
+
+def traffic_order(bots, days=TRAFFIC_WINDOW_DAYS):
+    """Sort bots by analytics hits over the last `days`, busiest first"""
+    since = datetime.utcnow() - timedelta(days=days)
+    hits = dict(
+        db.session.query(TriggerHourlyHits.bot_id, func.sum(TriggerHourlyHits.hits))
+        .filter(TriggerHourlyHits.hour >= since)
+        .group_by(TriggerHourlyHits.bot_id)
+        .all()
+    )
+    return sorted(bots, key=lambda bot: (-hits.get(bot.id, 0), bot.id))
+
+
+class StartupOrchestrator:
+    """Start a batch of bots at most `concurrency` at a time
+
+    `start` is bot_handler.start_bot; it returns a future that resolves when
+    the application is running (or None if the bot was not started),
+    and the bot reports readiness separately through `mark_ready`.
+    """
+
+    def __init__(self, start, concurrency=20, ready_timeout=READY_TIMEOUT):
+        self.start = start
+        self.concurrency = max(1, concurrency)
+        self.ready_timeout = ready_timeout
+        self._lock = threading.Lock()
+        # bot_id -> state, for the bots of the current startup run
+        self._states = {}
+        # bot_id -> Event set once the bot is ready, failed or skipped
+        self._settled = {}
+        self._thread = None
+
+    def counts(self):
+        with self._lock:
+            states = list(self._states.values())
+        return {state: states.count(state) for state in STATES}
+
+    def _set_state(self, bot_id, state):
+        with self._lock:
+            if bot_id not in self._states:
+                return
+            self._states[bot_id] = state
+            settled = self._settled.get(bot_id)
+        if settled is not None and state in ('ready', 'failed', 'skipped'):
+            settled.set()
+
+    def mark_ready(self, bot_id):
+        self._set_state(bot_id, 'ready')
+
+    def mark_failed(self, bot_id):
+        self._set_state(bot_id, 'failed')
+
+    def start_all(self, app, load_bots):
+        """Start bots in a background thread and return it at once
+
+        `load_bots` is called inside an app context and returns the bot
+        models to start.
+        """
+        self._thread = threading.Thread(target=self._run, args=(app, load_bots), daemon=True, name="BotStartup")
+        self._thread.start()
+        return self._thread
+
+    def _run(self, app, load_bots):
+        started = time.monotonic()
+        try:
+            with app.app_context():
+                bots = traffic_order(load_bots())
+                with self._lock:
+                    self._states = {bot.id: 'queued' for bot in bots}
+                    self._settled = {bot.id: threading.Event() for bot in bots}
+                logger.info("Starting %d bot(s), %d at a time", len(bots), self.concurrency)
+
+                slots = threading.BoundedSemaphore(self.concurrency)
+                waiters = []
+                for bot in bots:
+                    slots.acquire()
+                    self._set_state(bot.id, 'starting')
+                    try:
+                        future = self.start(bot, app)
+                    except Exception:
+                        logger.exception("Error starting bot", extra={'bot_id': bot.id})
+                        future = None
+                    if future is None:
+                        self._set_state(bot.id, 'skipped')
+                        slots.release()
+                        continue
+                    future.add_done_callback(lambda f, bot_id=bot.id: self._on_started(bot_id, f))
+                    # Hold the slot until the bot is ready, failed or timed out
+                    waiter = threading.Thread(
+                        target=self._release_when_settled, args=(bot.id, slots), daemon=True
+                    )
+                    waiter.start()
+                    waiters.append(waiter)
+                for waiter in waiters:
+                    waiter.join()
+        except Exception:
+            logger.exception("Error during bot startup")
+            return
+
+        counts = self.counts()
+        logger.info(
+            "Bot startup finished in %.2fs: %d ready, %d failed, %d skipped, %d not ready yet",
+            time.monotonic() - started, counts['ready'], counts['failed'], counts['skipped'], counts['starting']
+        )
+
+    def _on_started(self, bot_id, future):
+        if future.exception() is not None:
+            self.mark_failed(bot_id)
+
+    def _release_when_settled(self, bot_id, slots):
+        try:
+            if not self._settled[bot_id].wait(self.ready_timeout):
+                logger.warning(
+                    "Bot not ready after %.0fs, starting the next one", self.ready_timeout,
+                    extra={'bot_id': bot_id}
+                )
+        finally:
+            slots.release()
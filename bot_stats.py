@@ -0,0 +1,42 @@
+"""
+Bot Statistics
+Aggregated per-bot rule counts fetched in a single grouped query
+"""
+from sqlalchemy import func
+from models import db, Bot, Message, Button
+
+
+def _count_by_bot(model, user_id):
+    """Subquery of (bot_id, count) for one rule table, limited to a user's bots"""
+    return (
+        db.session.query(model.bot_id.label('bot_id'), func.count(model.id).label('count'))
+        .join(Bot, Bot.id == model.bot_id)
+        .filter(Bot.user_id == user_id)
+        .group_by(model.bot_id)
+        .subquery()
+    )
+
+
+def get_user_bot_stats(user_id):
+    """Return each of a user's bots with its message and button counts
+
+    One round trip regardless of how many bots or rules the user has.
+    """
+    message_counts = _count_by_bot(Message, user_id)
+    button_counts = _count_by_bot(Button, user_id)
+    rows = (
+        db.session.query(
+            Bot,
+            func.coalesce(message_counts.c.count, 0),
+            func.coalesce(button_counts.c.count, 0)
+        )
+        .outerjoin(message_counts, message_counts.c.bot_id == Bot.id)
+        .outerjoin(button_counts, button_counts.c.bot_id == Bot.id)
+        .filter(Bot.user_id == user_id)
+        .order_by(Bot.id)
+        .all()
+    )
+    return [
+        {'bot': bot, 'messages_count': messages_count, 'buttons_count': buttons_count}
+        for bot, messages_count, buttons_count in rows
+    ]
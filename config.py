@@ -8,10 +8,60 @@ class Config:
     # Database configuration
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{BASE_DIR / "instance" / "database.db"}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Web requests and the bot runtime share this pool; SQLite pragmas are set in models.py
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': 10,
+        'pool_pre_ping': True,
+        'connect_args': {'timeout': 5, 'check_same_thread': False},
+    }
     
     # Secret key for sessions (change in production)
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     
+    # Logging level; DEBUG logs every update and should stay off in production
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    
     # Telegram Bot API settings
-    TELEGRAM_API_URL = 'https://api.telegram.org/bot'
+    # Override to point every bot at another Bot API server, e.g. fake_telegram.py
+    TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+    # Seconds a cached getMe result is considered fresh
+    TOKEN_STATUS_TTL = int(os.environ.get('TOKEN_STATUS_TTL', 300))
+    
+    # Seconds between full bot table resyncs; changes are normally applied from events
+    BOT_RESYNC_INTERVAL = int(os.environ.get('BOT_RESYNC_INTERVAL', 300))
+    
+    # Bots whose compiled rules stay cached; least recently used ones are evicted
+    RULE_CACHE_SIZE = int(os.environ.get('RULE_CACHE_SIZE', 1000))
+    
+    # Bots started at the same time on startup; each holds a slot until its first getUpdates succeeds
+    BOT_STARTUP_CONCURRENCY = int(os.environ.get('BOT_STARTUP_CONCURRENCY', 20))
+    
+    # Where bots run: 'embedded' in the web process, or 'external' under bot_runner.py
+    BOT_RUNNER = os.environ.get('BOT_RUNNER', 'embedded')
+    BOT_RUNNER_HOST = os.environ.get('BOT_RUNNER_HOST', '127.0.0.1')
+    BOT_RUNNER_PORT = int(os.environ.get('BOT_RUNNER_PORT', 6001))
+    BOT_RUNNER_WORKERS = int(os.environ.get('BOT_RUNNER_WORKERS', 2))
+    # Shared by the panel and bot_runner.py to authenticate the control channel;
+    # required, and must differ from SECRET_KEY
+    BOT_RUNNER_SECRET = os.environ.get('BOT_RUNNER_SECRET', '')
+    
+    # Conversation states kept in memory, and seconds of inactivity before a chat's state is forgotten
+    CONVERSATION_STATE_SIZE = int(os.environ.get('CONVERSATION_STATE_SIZE', 100000))
+    CONVERSATION_STATE_TTL = int(os.environ.get('CONVERSATION_STATE_TTL', 3600))
+    # Seconds between snapshots of changed states to the database; 0 keeps them in memory only
+    CONVERSATION_SNAPSHOT_INTERVAL = float(os.environ.get('CONVERSATION_SNAPSHOT_INTERVAL', 0))
+    
+    # Analytics events buffered in memory before the oldest are dropped, and
+    # how often (seconds) the background flusher writes them out
+    ANALYTICS_BUFFER_SIZE = int(os.environ.get('ANALYTICS_BUFFER_SIZE', 50000))
+    ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 5))
+    # Raw events older than this are deleted; hourly rollups are kept
+    ANALYTICS_RETENTION_DAYS = int(os.environ.get('ANALYTICS_RETENTION_DAYS', 30))
+    
+    # How bots receive updates: 'polling' (getUpdates) or 'webhook'
+    BOT_UPDATE_MODE = os.environ.get('BOT_UPDATE_MODE', 'polling')
+    # Public HTTPS base URL of this panel, required for webhook mode
+    WEBHOOK_BASE_URL = os.environ.get('WEBHOOK_BASE_URL', '')
 
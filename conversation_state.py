@@ -0,0 +1,204 @@
+"""
+Conversation State
+Per-(bot_id, chat_id) state for multi-step flows, kept in memory with
+LRU and idle-TTL eviction and optionally snapshotted to SQLite by a
+background thread so it survives restarts
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import delete, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, ConversationState
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Longest state name; matches the rule and snapshot columns
+MAX_STATE_LENGTH = 50
+
+
+class ConversationStateStore:
+    """LRU map of (bot_id, chat_id) -> state name that forgets idle chats
+
+    Every read or write moves a chat to the end and pushes its expiry out
+    by `ttl`, so the OrderedDict is ordered by expiry as well as recency
+    and expired chats are always at the front.
+    """
+
+    def __init__(self, max_entries=100000, ttl=3600, snapshot_interval=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.snapshot_interval = snapshot_interval
+        # key -> [state, expires_at, last access]; snapshots persist the last
+        # access as updated_at, so restored chats keep their idle-based expiry
+        self._states = OrderedDict()
+        # Keys set, cleared or read since the last snapshot, tracked only when snapshots are on
+        self._dirty = set()
+        self._track = snapshot_interval > 0
+        self._lock = threading.Lock()
+        self._app = None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._states)
+
+    def get(self, bot_id, chat_id):
+        """Return the chat's current state, or None"""
+        key = (bot_id, chat_id)
+        now = time.time()
+        with self._lock:
+            entry = self._states.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._states[key]
+                return None
+            entry[1] = now + self.ttl
+            entry[2] = now
+            self._states.move_to_end(key)
+            if self._track:
+                self._dirty.add(key)
+            return entry[0]
+
+    def set(self, bot_id, chat_id, state):
+        """Set the chat's state; None or '' clears it"""
+        key = (bot_id, chat_id)
+        now = time.time()
+        with self._lock:
+            if state:
+                self._states[key] = [state, now + self.ttl, now]
+                self._states.move_to_end(key)
+                self._evict(now)
+            else:
+                self._states.pop(key, None)
+            if self._track:
+                self._dirty.add(key)
+
+    def advance(self, bot_id, chat_id, rule, state=None):
+        """Move a chat on after `rule` answered it in `state`, returns the new state
+
+        A rule with a next state moves the chat there. A rule that was
+        waiting for a state without naming a next one ends the flow; other
+        rules leave the state alone, so a global "help" doesn't reset it.
+        """
+        if rule.next_state:
+            if rule.next_state != state:
+                self.set(bot_id, chat_id, rule.next_state)
+            return rule.next_state
+        if rule.state:
+            self.set(bot_id, chat_id, None)
+            return None
+        return state
+
+    def _evict(self, now):
+        """Drop expired chats, then the least recently used ones over the limit (caller holds the lock)"""
+        states = self._states
+        while states:
+            key, entry = next(iter(states.items()))
+            if entry[1] > now and len(states) <= self.max_entries:
+                break
+            del states[key]
+
+    # -- Snapshots -----------------------------------------------------------
+
+    def start(self, app):
+        """Start periodic snapshots for `app` when enabled; safe to call repeatedly"""
+        if self.snapshot_interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._run, daemon=True, name="ConversationSnapshots")
+            self._thread.start()
+        atexit.register(self.snapshot)
+
+    def restore(self, app, bot_id):
+        """Load a bot's unexpired states from the last snapshot, e.g. when it starts"""
+        if self.snapshot_interval <= 0:
+            return 0
+        now = time.time()
+        since = datetime.utcfromtimestamp(now - self.ttl)
+        with app.app_context():
+            rows = (
+                db.session.query(ConversationState.chat_id, ConversationState.state, ConversationState.updated_at)
+                .filter(ConversationState.bot_id == bot_id, ConversationState.updated_at > since)
+                .order_by(ConversationState.updated_at)
+                .all()
+            )
+        with self._lock:
+            for chat_id, state, updated_at in rows:
+                key = (bot_id, chat_id)
+                if key in self._states or key in self._dirty:
+                    continue  # newer than the snapshot
+                updated = (updated_at - datetime(1970, 1, 1)).total_seconds()
+                self._states[key] = [state, updated + self.ttl, updated]
+            self._evict(now)
+        if rows:
+            logger.info("Restored %d conversation state(s)", len(rows), extra={'bot_id': bot_id})
+        return len(rows)
+
+    def snapshot(self):
+        """Write states changed or read since the last snapshot, returns how many"""
+        if self._app is None:
+            return 0
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            changes = [(key, self._states.get(key)) for key in dirty]
+        if not changes:
+            return 0
+
+        upserts = [
+            {
+                'bot_id': bot_id, 'chat_id': chat_id, 'state': entry[0],
+                'updated_at': datetime.utcfromtimestamp(entry[2]),
+            }
+            for (bot_id, chat_id), entry in changes if entry is not None
+        ]
+        removed = [key for key, entry in changes if entry is None]
+        try:
+            with self._app.app_context():
+                if upserts:
+                    statement = sqlite_insert(ConversationState)
+                    db.session.execute(
+                        statement.on_conflict_do_update(
+                            index_elements=['bot_id', 'chat_id'],
+                            set_={'state': statement.excluded.state, 'updated_at': statement.excluded.updated_at}
+                        ),
+                        upserts
+                    )
+                if removed:
+                    table = ConversationState.__table__
+                    db.session.execute(
+                        delete(table).where(table.c.bot_id == bindparam('b'), table.c.chat_id == bindparam('c')),
+                        [{'b': bot_id, 'c': chat_id} for bot_id, chat_id in removed]
+                    )
+                # Expired rows would never be restored
+                db.session.execute(delete(ConversationState).where(
+                    ConversationState.updated_at <= datetime.utcfromtimestamp(time.time() - self.ttl)
+                ))
+                db.session.commit()
+        except Exception:
+            # Retry on the next snapshot, which writes whatever is current by then
+            with self._lock:
+                self._dirty.update(dirty)
+            logger.exception("Error writing conversation state snapshot")
+            return 0
+        return len(changes)
+
+    def _run(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            self.snapshot()
+            with self._lock:
+                self._evict(time.time())
+
+
+# Global store shared by the handlers of every bot in this process
+conversation_states = ConversationStateStore(
+    Config.CONVERSATION_STATE_SIZE, Config.CONVERSATION_STATE_TTL, Config.CONVERSATION_SNAPSHOT_INTERVAL
+)
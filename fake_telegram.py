@@ -0,0 +1,411 @@
+"""
+Fake Telegram Bot API - Local stand-in for end-to-end load testing
+Serves getMe, getUpdates, sendMessage, answerCallbackQuery and
+editMessageText for any token, generates update streams and records
+every reply so the full start_bot -> polling -> reply pipeline can be
+measured offline
+
+Usage:
+    python fake_telegram.py serve --port 8081
+        then run the panel with TELEGRAM_API_URL=http://127.0.0.1:8081/bot
+    python fake_telegram.py load-test --bots 200 --rate 2 --duration 30
+
+A standalone server is driven through control endpoints (JSON bodies):
+    POST /_fake/updates    {"token": ..., "text": ...} or {"token": ..., "callback_data": ...},
+                           or a list of them; {"token": ..., "update": {...}} queues a raw update
+    POST /_fake/generate   {"scripts": {token: {"messages": [...], "clicks": [...]}},
+                            "rate": 1.0, "duration": 10, "click_share": 0.2}
+    GET  /_fake/replies    ?since=N&token=...  recorded replies with latencies
+    POST /_fake/reset      forget recorded replies
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Longest getUpdates long-poll the fake server will hold open
+MAX_POLL_TIMEOUT = 10
+
+
+class FakeBotState:
+    """Pending updates and recorded replies for one bot token"""
+
+    def __init__(self, token):
+        self.token = token
+        self.bot_id = int(token.split(':', 1)[0]) if token.split(':', 1)[0].isdigit() else abs(hash(token)) % 10**9
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.polled = threading.Event()
+        self.condition = threading.Condition()
+
+
+class FakeTelegramAPI:
+    """In-memory Bot API state shared by the HTTP handler threads"""
+
+    def __init__(self):
+        self._bots = {}
+        self._lock = threading.Lock()
+        self.replies = []
+        self.sent_at = {}
+        self.requests = 0
+
+    def bot(self, token):
+        with self._lock:
+            state = self._bots.get(token)
+            if state is None:
+                state = self._bots[token] = FakeBotState(token)
+            return state
+
+    def push_update(self, token, update):
+        """Queue a raw update dict (without update_id) for a bot"""
+        state = self.bot(token)
+        with state.condition:
+            update = dict(update, update_id=state.next_update_id)
+            state.next_update_id += 1
+            state.updates.append(update)
+            state.condition.notify_all()
+        return update
+
+    def push_message(self, token, text, chat_id=None, first_name='Load'):
+        """Queue a text message from a user; the chat id doubles as the correlation key"""
+        chat_id = chat_id or random.randint(10**6, 10**9)
+        state = self.bot(token)
+        with state.condition:
+            message_id = state.next_message_id
+            state.next_message_id += 1
+        self.sent_at[(token, chat_id)] = time.perf_counter()
+        return self.push_update(token, {
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private', 'first_name': first_name},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': first_name},
+                'text': text,
+            }
+        })
+
+    def push_callback(self, token, data, chat_id=None):
+        """Queue a callback query (inline button click)"""
+        chat_id = chat_id or random.randint(10**6, 10**9)
+        self.sent_at[(token, chat_id)] = time.perf_counter()
+        return self.push_update(token, {
+            'callback_query': {
+                'id': str(random.getrandbits(48)),
+                'chat_instance': str(chat_id),
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+                'data': data,
+                'message': {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'text': 'menu',
+                },
+            }
+        })
+
+    def record_reply(self, token, method, params):
+        chat_id = params.get('chat_id')
+        sent = self.sent_at.pop((token, chat_id), None)
+        self.replies.append({
+            'token': token,
+            'method': method,
+            'chat_id': chat_id,
+            'text': params.get('text'),
+            'latency': time.perf_counter() - sent if sent else None,
+        })
+
+    def control(self, action, params):
+        """Handle a /_fake/<action> request from a test driver"""
+        if action == 'updates':
+            items = params.get('items', [params])
+            pushed = []
+            for item in items:
+                token = item['token']
+                if 'update' in item:
+                    pushed.append(self.push_update(token, item['update']))
+                elif 'callback_data' in item:
+                    pushed.append(self.push_callback(token, item['callback_data'], item.get('chat_id')))
+                else:
+                    pushed.append(self.push_message(token, item['text'], item.get('chat_id')))
+            return pushed
+
+        if action == 'generate':
+            scripts = {}
+            for token, script in params['scripts'].items():
+                if isinstance(script, list):
+                    script = {'messages': script}
+                scripts[token] = (script.get('messages') or [], script.get('clicks') or [])
+            generator = UpdateGenerator(
+                self, scripts, float(params.get('rate', 1.0)), float(params.get('click_share', 0.0))
+            )
+            duration = float(params.get('duration', 10.0))
+            threading.Thread(target=generator.run, args=(duration,), daemon=True, name="FakeUpdateGenerator").start()
+            return {'bots': len(scripts), 'duration': duration}
+
+        if action == 'replies':
+            since = int(params.get('since') or 0)
+            token = params.get('token')
+            replies = self.replies[since:]
+            return {
+                'replies': [reply for reply in replies if token is None or reply['token'] == token],
+                'next': since + len(replies),
+            }
+
+        if action == 'reset':
+            self.replies = []
+            self.sent_at.clear()
+            return True
+
+        raise ValueError(f"unknown control action '{action}'")
+
+    def call(self, token, method, params):
+        """Execute a Bot API method and return its result"""
+        self.requests += 1
+        state = self.bot(token)
+        method = method.lower()
+
+        if method == 'getme':
+            return {'id': state.bot_id, 'is_bot': True, 'first_name': f'Fake {state.bot_id}', 'username': f'fake_{state.bot_id}_bot'}
+
+        if method == 'getupdates':
+            offset = int(params.get('offset') or 0)
+            limit = int(params.get('limit') or 100)
+            timeout = min(float(params.get('timeout') or 0), MAX_POLL_TIMEOUT)
+            deadline = time.monotonic() + timeout
+            state.polled.set()
+            with state.condition:
+                # Confirm everything below the offset, as Telegram does
+                state.updates = [u for u in state.updates if u['update_id'] >= offset]
+                while not state.updates and time.monotonic() < deadline:
+                    state.condition.wait(deadline - time.monotonic())
+                return state.updates[:limit]
+
+        if method in ('sendmessage', 'editmessagetext'):
+            self.record_reply(token, method, params)
+            chat_id = params.get('chat_id') or 0
+            with state.condition:
+                message_id = state.next_message_id
+                state.next_message_id += 1
+            return {
+                'message_id': params.get('message_id') or message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': state.bot_id, 'is_bot': True, 'first_name': f'Fake {state.bot_id}'},
+                'text': params.get('text', ''),
+            }
+
+        if method == 'answercallbackquery':
+            self.record_reply(token, method, params)
+            return True
+
+        # setWebhook, deleteWebhook, setMyCommands, ... just succeed
+        return True
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    """Route /bot<token>/<method> requests to the shared FakeTelegramAPI"""
+
+    api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _params(self):
+        parsed = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if body and 'json' in content_type:
+            data = json.loads(body)
+            params.update(data if isinstance(data, dict) else {'items': data})
+        elif body:
+            # python-telegram-bot sends form fields with JSON-encoded values
+            for key, values in parse_qs(body.decode('utf-8')).items():
+                try:
+                    params[key] = json.loads(values[-1])
+                except ValueError:
+                    params[key] = values[-1]
+        return parsed.path, params
+
+    def _handle(self):
+        path, params = self._params()
+        parts = path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == '_fake':
+            try:
+                self._respond(200, {'ok': True, 'result': self.api.control(parts[1], params)})
+            except Exception as e:
+                self._respond(400, {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e!r}'})
+            return
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self._respond(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        token, method = parts[0][3:], parts[1]
+        try:
+            result = self.api.call(token, method, params)
+            self._respond(200, {'ok': True, 'result': result})
+        except Exception as e:
+            self._respond(400, {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'})
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Hundreds of bots connect at once on startup; the default backlog of 5 drops them
+    request_queue_size = 1024
+
+
+def start_fake_server(host='127.0.0.1', port=0):
+    """Start the fake Bot API in a background thread, returns (server, api, base_url)"""
+    api = FakeTelegramAPI()
+    handler = type('BoundFakeTelegramHandler', (FakeTelegramHandler,), {'api': api})
+    server = FakeTelegramServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="FakeTelegramAPI").start()
+    base_url = f"http://{host}:{server.server_address[1]}/bot"
+    return server, api, base_url
+
+
+class UpdateGenerator:
+    """Push messages and button clicks to many bots at a steady per-bot rate"""
+
+    def __init__(self, api, scripts, rate=1.0, click_share=0.0):
+        # scripts: token -> (message texts, callback data values)
+        self.api = api
+        self.scripts = scripts
+        self.tokens = list(scripts)
+        self.rate = rate
+        self.click_share = click_share
+        self.sent = 0
+
+    def run(self, duration):
+        interval = 1.0 / (self.rate * len(self.tokens))
+        deadline = time.monotonic() + duration
+        next_at = time.monotonic()
+        while time.monotonic() < deadline:
+            token = random.choice(self.tokens)
+            texts, clicks = self.scripts[token]
+            if clicks and random.random() < self.click_share:
+                self.api.push_callback(token, random.choice(clicks))
+            else:
+                self.api.push_message(token, random.choice(texts))
+            self.sent += 1
+            next_at += interval
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def load_test(bots, rate, duration, rules, click_share):
+    """Run hundreds of bots against the fake API and report end-to-end throughput"""
+    server, api, base_url = start_fake_server()
+
+    # Point every bot at the fake server before the runtime builds any Application
+    from config import Config
+    Config.TELEGRAM_API_URL = base_url
+
+    from benchmark import create_benchmark_app, seed_bot
+    from models import db, Bot
+    from bot_handler import start_bot, stop_bot, bot_applications
+    from analytics import recorder
+    from rule_cache import rule_cache, callback_data
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_benchmark_app(f"{tmp}/load_test.db")
+        scripts = {}
+        for index in range(bots):
+            bot_id, _, trigger_texts = seed_bot(app, max(1, rules // 10), rules - rules // 10, rng)
+            with app.app_context():
+                bot = db.session.get(Bot, bot_id)
+                bot.token = f"{100000 + index}:fake-token"
+                bot.is_active = True
+                db.session.commit()
+                clicks = [callback_data(button.id) for button in rule_cache.get(app, bot_id).buttons[:2]]
+                scripts[bot.token] = ([f"please {text} now" for text in trigger_texts[:5]], clicks)
+
+        print(f"Starting {bots} bots against {base_url} ...")
+        started = time.perf_counter()
+        with app.app_context():
+            for bot in Bot.query.filter_by(is_active=True).all():
+                start_bot(bot, app)
+        for token in scripts:
+            api.bot(token).polled.wait(60)
+        print(f"All bots polling after {time.perf_counter() - started:.2f}s")
+
+        generator = UpdateGenerator(api, scripts, rate, click_share)
+        print(f"Sending ~{rate * bots:.0f} updates/s for {duration}s ...")
+        generator.run(duration)
+        time.sleep(2)  # let in-flight updates finish
+
+        latencies = sorted(r['latency'] for r in api.replies if r['latency'] is not None)
+        answered = len(latencies)
+        print(f"\nUpdates sent:      {generator.sent}")
+        print(f"Replies recorded:  {len(api.replies)} ({answered} correlated)")
+        print(f"Throughput:        {answered / duration:.1f} replies/s")
+        if latencies:
+            print(f"Reply latency p50: {latencies[len(latencies) // 2] * 1000:.1f} ms")
+            print(f"Reply latency p99: {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f} ms")
+        print(f"API requests:      {api.requests}")
+
+        for bot_id in list(bot_applications):
+            future = stop_bot(bot_id)
+            if future:
+                future.result(30)
+        # Write buffered analytics while the temporary database still exists
+        recorder.flush()
+        with app.app_context():
+            db.engine.dispose()
+    server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API for load testing")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="run the fake API server")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8081)
+
+    load = commands.add_parser('load-test', help="run bots end to end against an in-process fake API")
+    load.add_argument('--bots', type=int, default=100)
+    load.add_argument('--rate', type=float, default=1.0, help="updates per second per bot")
+    load.add_argument('--duration', type=float, default=20.0, help="seconds to generate updates")
+    load.add_argument('--rules', type=int, default=50, help="rules per bot")
+    load.add_argument('--click-share', type=float, default=0.2, help="share of updates that are button clicks")
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        server, api, base_url = start_fake_server(args.host, args.port)
+        print(f"Fake Telegram Bot API listening, set TELEGRAM_API_URL={base_url}")
+        print(f"Control endpoints at {base_url[:-len('/bot')]}/_fake/ (updates, generate, replies, reset)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        load_test(args.bots, args.rate, args.duration, args.rules, args.click_share)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+Trigger Matcher
+Compiles a bot's button texts and trigger texts into a single
+Aho-Corasick automaton so the winning rule is found in one pass, with
+whole-word, prefix, exact and regex triggers precompiled alongside it
+"""
+import re
+
+# Trigger match types, in the order shown in forms
+MATCH_TYPES = (
+    ('substring', 'Contains'),
+    ('word', 'Whole word'),
+    ('prefix', 'Starts with'),
+    ('exact', 'Exact message'),
+    ('regex', 'Regular expression'),
+    ('any', 'Any message'),
+)
+DEFAULT_MATCH_TYPE = 'substring'
+
+
+class TriggerMatcher:
+    """Case-insensitive multi-pattern substring matcher with rule priority
+
+    Patterns are given in priority order; when several patterns occur in
+    the text, the one given first wins, exactly like checking each rule
+    in turn with `pattern.lower() in text.lower()`.
+    """
+
+    def __init__(self, rules):
+        """Build the automaton from an iterable of (pattern, value) pairs"""
+        self.values = []
+        self._goto = [{}]
+        self._fail = [0]
+        # Best (lowest) rule rank that ends at each state, including
+        # everything reachable through failure links
+        self._best = [None]
+        # (rank, length) of the pattern ending exactly at each state, and
+        # the nearest failure-link state that has one, for iter_matches
+        self._own = [None]
+        self._dict_link = [0]
+
+        for rank, (pattern, value) in enumerate(rules):
+            self.values.append(value)
+            self._add_pattern((pattern or '').lower(), rank)
+
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self.values)
+
+    def _add_pattern(self, pattern, rank):
+        """Insert a pattern into the trie"""
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+                self._own.append(None)
+                self._dict_link.append(0)
+            state = next_state
+        if self._best[state] is None or rank < self._best[state]:
+            self._best[state] = rank
+            self._own[state] = (rank, len(pattern))
+
+    def _build_failure_links(self):
+        """Compute failure links breadth-first and fold in output ranks"""
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                fail_state = self._fail[next_state]
+                self._dict_link[next_state] = fail_state if self._own[fail_state] is not None else self._dict_link[fail_state]
+                inherited = self._best[self._fail[next_state]]
+                if inherited is not None and (self._best[next_state] is None or inherited < self._best[next_state]):
+                    self._best[next_state] = inherited
+
+    def match_rank(self, text):
+        """Return the rank of the highest-priority pattern found in text, or None"""
+        goto = self._goto
+        fail = self._fail
+        best_at = self._best
+
+        # Empty patterns match every message
+        best = best_at[0]
+        if best == 0:
+            return 0
+
+        state = 0
+        for char in (text or '').lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            rank = best_at[state]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+                if best == 0:
+                    break
+        return best
+
+    def match(self, text):
+        """Return the value of the highest-priority pattern found in text, or None"""
+        rank = self.match_rank(text)
+        if rank is None:
+            return None
+        return self.values[rank]
+
+    def iter_matches(self, lowered):
+        """Yield (start, end, rank) for every pattern occurrence in already-lowercased text"""
+        goto = self._goto
+        fail = self._fail
+        own = self._own
+        dict_link = self._dict_link
+        state = 0
+        for end, char in enumerate(lowered, start=1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            output = state if own[state] is not None else dict_link[state]
+            while output:
+                rank, length = own[output]
+                yield end - length, end, rank
+                output = dict_link[output]
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+def validate_regex(pattern):
+    """Return an error message if a regex trigger can't be compiled, else None"""
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        return str(e)
+    return None
+
+
+class RuleMatcher:
+    """Priority-ordered matcher over triggers of every match type
+
+    Each match type uses the cheapest structure that finds its best rule:
+
+    - substring: a TriggerMatcher over the whole message
+    - word: a second automaton whose hits are checked for word boundaries
+    - prefix and exact: dictionary lookups on the normalized message
+    - regex: compiled case-insensitive patterns searched in priority order
+    - any: matches every message, so the first one is simply the starting best rank
+
+    The lowest rank across all of them wins, and the more expensive passes
+    are skipped once they can no longer beat the best rank found so far.
+    Regex triggers are not merged into one lookahead alternation: with
+    Python's re that is about twice as slow as searching each compiled
+    pattern, which keeps its literal-prefix fast path.
+    """
+
+    def __init__(self, rules):
+        """Build from an iterable of (pattern, match_type, value) in priority order"""
+        self.values = []
+        substring_rules = []
+        word_rules = []
+        # Normalized pattern -> best rank
+        self._prefixes = {}
+        self._exact = {}
+        # (rank, compiled pattern) in priority order
+        self._regexes = []
+        self._any_rank = None
+
+        for rank, (pattern, match_type, value) in enumerate(rules):
+            self.values.append(value)
+            pattern = pattern or ''
+            if match_type == 'word':
+                if pattern.strip():
+                    word_rules.append((rank, pattern))
+            elif match_type == 'prefix':
+                self._prefixes.setdefault(pattern.lstrip().lower(), rank)
+            elif match_type == 'exact':
+                self._exact.setdefault(pattern.strip().lower(), rank)
+            elif match_type == 'any':
+                if self._any_rank is None:
+                    self._any_rank = rank
+            elif match_type == 'regex':
+                # Invalid patterns never match; the forms reject them before they get here
+                if validate_regex(pattern) is None:
+                    self._regexes.append((rank, re.compile(pattern, re.IGNORECASE)))
+            else:
+                # 'substring', and anything unknown, keeps the original behaviour
+                substring_rules.append((rank, pattern))
+
+        self._substring_ranks = [rank for rank, _ in substring_rules]
+        self._substrings = TriggerMatcher((pattern, index) for index, (_, pattern) in enumerate(substring_rules))
+        self._word_ranks = [rank for rank, _ in word_rules]
+        self._words = TriggerMatcher((pattern, index) for index, (_, pattern) in enumerate(word_rules))
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes})
+        self._best_word_rank = min(self._word_ranks) if self._word_ranks else None
+
+    def __len__(self):
+        return len(self.values)
+
+    def _match_word(self, lowered, best):
+        ranks = self._word_ranks
+        length = len(lowered)
+        for start, end, index in self._words.iter_matches(lowered):
+            rank = ranks[index]
+            if best is not None and rank >= best:
+                continue
+            if start > 0 and _is_word_char(lowered[start - 1]):
+                continue
+            if end < length and _is_word_char(lowered[end]):
+                continue
+            best = rank
+            if rank == self._best_word_rank:
+                break
+        return best
+
+    def match_rank(self, text):
+        """Return the rank of the highest-priority rule matching text, or None"""
+        text = text or ''
+        best = self._any_rank
+        if len(self._substrings):
+            index = self._substrings.match_rank(text)
+            if index is not None and (best is None or self._substring_ranks[index] < best):
+                best = self._substring_ranks[index]
+
+        if self._exact or self._prefixes:
+            stripped = text.strip().lower()
+            rank = self._exact.get(stripped)
+            if rank is not None and (best is None or rank < best):
+                best = rank
+            if self._prefixes:
+                leading = text.lstrip().lower()
+                for length in self._prefix_lengths:
+                    if length > len(leading):
+                        break
+                    rank = self._prefixes.get(leading[:length])
+                    if rank is not None and (best is None or rank < best):
+                        best = rank
+
+        if self._best_word_rank is not None and (best is None or self._best_word_rank < best):
+            best = self._match_word(text.lower(), best)
+
+        for rank, pattern in self._regexes:
+            if best is not None and rank >= best:
+                break
+            if pattern.search(text):
+                best = rank
+                break
+        return best
+
+    def match(self, text):
+        """Return the value of the highest-priority rule matching text, or None"""
+        rank = self.match_rank(text)
+        if rank is None:
+            return None
+        return self.values[rank]
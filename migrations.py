@@ -0,0 +1,229 @@
+"""
+Database Migrations
+Versioned schema changes tracked with SQLite's PRAGMA user_version,
+replacing db.create_all() so existing databases pick up new indexes
+and columns
+
+Usage:
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # show current and latest version
+"""
+import logging
+from contextlib import contextmanager
+from sqlalchemy.exc import OperationalError
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+def _add_rule_search(connection):
+    """FTS5 trigram indexes over rule texts, kept in sync by triggers
+
+    Skipped with a warning when SQLite was built without FTS5 or is older
+    than 3.34 (no trigram tokenizer); rule search then falls back to LIKE.
+    """
+    for table, text_column in (('messages', 'trigger_text'), ('buttons', 'button_text')):
+        fts = f"{table}_fts"
+        try:
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"{text_column}, response_text, content='{table}', content_rowid='id', tokenize='trigram')"
+            )
+        except OperationalError as e:
+            logger.warning("SQLite full-text search unavailable (%s), rule search will use LIKE", e.orig)
+            return
+        new = f"new.id, new.{text_column}, new.response_text"
+        old = f"'delete', old.id, old.{text_column}, old.response_text"
+        columns = f"rowid, {text_column}, response_text"
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}({columns}) VALUES ({new}); END"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, {columns}) VALUES ({old}); END"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {text_column}, response_text ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, {columns}) VALUES ({old}); "
+            f"INSERT INTO {fts}({columns}) VALUES ({new}); END"
+        )
+        connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+# (version, description, SQL statements or callable(connection))
+# Never edit a released migration; append a new one instead.
+MIGRATIONS = [
+    (1, "Initial schema", [
+        """CREATE TABLE IF NOT EXISTS users (
+            id INTEGER NOT NULL,
+            username VARCHAR(80) NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id)
+        )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+        """CREATE TABLE IF NOT EXISTS bots (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            token VARCHAR(200) NOT NULL,
+            is_active BOOLEAN,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS buttons (
+            id INTEGER NOT NULL,
+            bot_id INTEGER NOT NULL,
+            button_text VARCHAR(100) NOT NULL,
+            response_text TEXT NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(bot_id) REFERENCES bots (id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER NOT NULL,
+            bot_id INTEGER NOT NULL,
+            trigger_text VARCHAR(500) NOT NULL,
+            response_text TEXT NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(bot_id) REFERENCES bots (id)
+        )""",
+    ]),
+    (2, "Index rule foreign keys and button lookups", [
+        "CREATE INDEX IF NOT EXISTS ix_bots_user_id ON bots (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_bot_id ON messages (bot_id)",
+        "CREATE INDEX IF NOT EXISTS ix_buttons_bot_id ON buttons (bot_id)",
+        "CREATE INDEX IF NOT EXISTS ix_buttons_bot_id_button_text ON buttons (bot_id, button_text)",
+        "ANALYZE",
+    ]),
+    (3, "Add trigger match types", [
+        "ALTER TABLE messages ADD COLUMN match_type VARCHAR(20) NOT NULL DEFAULT 'substring'",
+        "ALTER TABLE buttons ADD COLUMN match_type VARCHAR(20) NOT NULL DEFAULT 'substring'",
+    ]),
+    (4, "Add analytics events and hourly trigger rollups", [
+        """CREATE TABLE IF NOT EXISTS analytics_events (
+            id INTEGER NOT NULL,
+            bot_id INTEGER NOT NULL,
+            kind VARCHAR(10) NOT NULL,
+            chat_id BIGINT,
+            user_id BIGINT,
+            rule_kind VARCHAR(10),
+            rule_id INTEGER,
+            text VARCHAR(255),
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_analytics_events_bot_id_created_at ON analytics_events (bot_id, created_at)",
+        """CREATE TABLE IF NOT EXISTS analytics_hourly (
+            bot_id INTEGER NOT NULL,
+            hour DATETIME NOT NULL,
+            rule_kind VARCHAR(10) NOT NULL,
+            rule_id INTEGER NOT NULL,
+            hits INTEGER NOT NULL,
+            PRIMARY KEY (bot_id, hour, rule_kind, rule_id)
+        )""",
+    ]),
+    (5, "Add conversation states", [
+        "ALTER TABLE messages ADD COLUMN state VARCHAR(50)",
+        "ALTER TABLE messages ADD COLUMN next_state VARCHAR(50)",
+        "ALTER TABLE buttons ADD COLUMN state VARCHAR(50)",
+        "ALTER TABLE buttons ADD COLUMN next_state VARCHAR(50)",
+        """CREATE TABLE IF NOT EXISTS conversation_states (
+            bot_id INTEGER NOT NULL,
+            chat_id BIGINT NOT NULL,
+            state VARCHAR(50) NOT NULL,
+            updated_at DATETIME NOT NULL,
+            PRIMARY KEY (bot_id, chat_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_conversation_states_updated_at ON conversation_states (updated_at)",
+    ]),
+    (6, "Add full-text rule search", _add_rule_search),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(connection):
+    return connection.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+
+@contextmanager
+def _transaction(engine):
+    """Connection inside an explicit transaction that also covers DDL
+
+    pysqlite only opens transactions before DML and commits implicitly
+    around DDL, so for SQLite its transaction handling is switched off on
+    this one connection and the transaction is begun by hand. BEGIN
+    IMMEDIATE takes the write lock up front, so the migration waits for
+    other writers (busy_timeout) instead of failing halfway.
+    """
+    with engine.connect() as connection:
+        if connection.dialect.name != 'sqlite':
+            with connection.begin():
+                yield connection
+            return
+        dbapi_connection = connection.connection.driver_connection
+        isolation_level = dbapi_connection.isolation_level
+        dbapi_connection.isolation_level = None
+        try:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+        finally:
+            # The connection goes back to the pool with pysqlite's defaults
+            dbapi_connection.isolation_level = isolation_level
+
+
+def run_migrations(app):
+    """Apply every pending migration in order, each in its own transaction
+
+    The transaction covers the DDL and the user_version bump (see
+    _transaction), so a failed migration leaves the schema and version as
+    they were and is simply retried on next start.
+    """
+    with app.app_context():
+        engine = db.engine
+        with engine.connect() as connection:
+            current = get_schema_version(connection)
+
+        pending = [m for m in MIGRATIONS if m[0] > current]
+        for version, description, steps in pending:
+            logger.info("Applying migration %d: %s", version, description)
+            with _transaction(engine) as connection:
+                if callable(steps):
+                    steps(connection)
+                else:
+                    for statement in steps:
+                        connection.exec_driver_sql(statement)
+                connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+        if pending:
+            logger.info("Database schema migrated from version %d to %d", current, pending[-1][0])
+        return pending[-1][0] if pending else current
+
+
+if __name__ == '__main__':
+    import sys
+    from flask import Flask
+    from config import Config
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+
+    if '--status' in sys.argv:
+        with app.app_context(), db.engine.connect() as connection:
+            print(f"Schema version {get_schema_version(connection)} (latest {LATEST_VERSION})")
+    else:
+        print(f"Schema version {run_migrations(app)}")
@@ -1,10 +1,28 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection for concurrent web and bot runtime access"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run while a writer commits instead of locking the whole file
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.close()
+
+
 class User(db.Model):
     """User model for authentication"""
     __tablename__ = 'users'
@@ -36,7 +54,7 @@ class Bot(db.Model):
     __tablename__ = 'bots'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     token = db.Column(db.String(200), nullable=False)
@@ -56,8 +74,14 @@ class Message(db.Model):
     __tablename__ = 'messages'
     
     id = db.Column(db.Integer, primary_key=True)
-    bot_id = db.Column(db.Integer, db.ForeignKey('bots.id'), nullable=False)
+    bot_id = db.Column(db.Integer, db.ForeignKey('bots.id'), nullable=False, index=True)
     trigger_text = db.Column(db.String(500), nullable=False)
+    # One of matcher.MATCH_TYPES
+    match_type = db.Column(db.String(20), nullable=False, default='substring', server_default='substring')
+    # Only match while the chat is in this conversation state (None = any state)
+    state = db.Column(db.String(50))
+    # Conversation state to move the chat to after replying
+    next_state = db.Column(db.String(50))
     response_text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -68,13 +92,75 @@ class Message(db.Model):
 class Button(db.Model):
     """Menu button model"""
     __tablename__ = 'buttons'
+    __table_args__ = (
+        db.Index('ix_buttons_bot_id_button_text', 'bot_id', 'button_text'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    bot_id = db.Column(db.Integer, db.ForeignKey('bots.id'), nullable=False)
+    bot_id = db.Column(db.Integer, db.ForeignKey('bots.id'), nullable=False, index=True)
     button_text = db.Column(db.String(100), nullable=False)
+    # One of matcher.MATCH_TYPES
+    match_type = db.Column(db.String(20), nullable=False, default='substring', server_default='substring')
+    # Only match while the chat is in this conversation state (None = any state)
+    state = db.Column(db.String(50))
+    # Conversation state to move the chat to after replying
+    next_state = db.Column(db.String(50))
     response_text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
         return f'<Button {self.button_text}>'
 
+
+
+class ConversationState(db.Model):
+    """Snapshot of a chat's conversation state, written by conversation_state.py"""
+    __tablename__ = 'conversation_states'
+    
+    bot_id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.BigInteger, primary_key=True)
+    state = db.Column(db.String(50), nullable=False)
+    # Last time the chat was read or written; restore and pruning expire it
+    # CONVERSATION_STATE_TTL seconds after that, like the in-memory store
+    updated_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<ConversationState bot={self.bot_id} chat={self.chat_id} {self.state}>'
+
+
+class AnalyticsEvent(db.Model):
+    """One inbound update and the rule that answered it, written in batches by analytics.py"""
+    __tablename__ = 'analytics_events'
+    __table_args__ = (
+        db.Index('ix_analytics_events_bot_id_created_at', 'bot_id', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, nullable=False)
+    # 'message' or 'callback'
+    kind = db.Column(db.String(10), nullable=False)
+    chat_id = db.Column(db.BigInteger)
+    user_id = db.Column(db.BigInteger)
+    # 'message' or 'button'; both NULL when nothing matched
+    rule_kind = db.Column(db.String(10))
+    rule_id = db.Column(db.Integer)
+    text = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<AnalyticsEvent {self.kind} bot={self.bot_id}>'
+
+
+class TriggerHourlyHits(db.Model):
+    """Hits per rule per hour, rolled up as events are flushed"""
+    __tablename__ = 'analytics_hourly'
+    
+    bot_id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    # rule_kind '' and rule_id 0 count updates that matched nothing
+    rule_kind = db.Column(db.String(10), primary_key=True)
+    rule_id = db.Column(db.Integer, primary_key=True)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<TriggerHourlyHits bot={self.bot_id} {self.hour} {self.rule_kind}:{self.rule_id}={self.hits}>'
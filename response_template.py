@@ -0,0 +1,151 @@
+"""
+Response Templates
+Compiles response texts with {variables} once per rule so sending a
+personalized reply is a plain join of precomputed parts
+"""
+import re
+from collections import OrderedDict
+from datetime import datetime
+
+# {name} is a variable if `name` is known; in a text with variables {{ and }}
+# are literal braces
+_TOKEN = re.compile(r'\{\{|\}\}|\{([a-z_]+)\}')
+
+# Per-user message counters kept for {message_count}
+MAX_COUNTERS = 100000
+
+
+class UserCounters:
+    """LRU-bounded count of messages per (bot_id, user_id) in this process"""
+
+    def __init__(self, max_entries=MAX_COUNTERS):
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+
+    def increment(self, bot_id, user_id):
+        key = (bot_id, user_id)
+        count = self._counts.pop(key, 0) + 1
+        self._counts[key] = count
+        if len(self._counts) > self.max_entries:
+            self._counts.popitem(last=False)
+        return count
+
+    def get(self, bot_id, user_id):
+        return self._counts.get((bot_id, user_id), 0)
+
+
+user_counters = UserCounters()
+
+
+def _time_of_day(now):
+    if 5 <= now.hour < 12:
+        return 'morning'
+    if 12 <= now.hour < 17:
+        return 'afternoon'
+    if 17 <= now.hour < 22:
+        return 'evening'
+    return 'night'
+
+
+def _user(update):
+    return update.effective_user if update is not None else None
+
+
+def _chat(update):
+    return update.effective_chat if update is not None else None
+
+
+def _chat_title(update):
+    chat = _chat(update)
+    if chat is None:
+        return ''
+    # Private chats have no title; use the other person's name instead
+    return chat.title or ' '.join(filter(None, (chat.first_name, chat.last_name)))
+
+
+def _message_count(update, bot_id):
+    user = _user(update)
+    return str(user_counters.get(bot_id, user.id)) if user is not None else '0'
+
+
+# name -> callable(update, bot_id, now) returning the substituted text
+VARIABLES = {
+    'first_name': lambda update, bot_id, now: (_user(update) and _user(update).first_name) or '',
+    'last_name': lambda update, bot_id, now: (_user(update) and _user(update).last_name) or '',
+    'full_name': lambda update, bot_id, now: (_user(update) and _user(update).full_name) or '',
+    'username': lambda update, bot_id, now: (_user(update) and _user(update).username) or '',
+    'user_id': lambda update, bot_id, now: str(_user(update).id) if _user(update) else '',
+    'chat_title': lambda update, bot_id, now: _chat_title(update),
+    'chat_id': lambda update, bot_id, now: str(_chat(update).id) if _chat(update) else '',
+    'time_of_day': lambda update, bot_id, now: _time_of_day(now),
+    'date': lambda update, bot_id, now: now.strftime('%Y-%m-%d'),
+    'time': lambda update, bot_id, now: now.strftime('%H:%M'),
+    'message_count': lambda update, bot_id, now: _message_count(update, bot_id),
+}
+
+
+class ResponseTemplate:
+    """A response text split into literal parts and variable names
+
+    `parts` alternates literal, variable, literal, ... and always starts
+    and ends with a literal, so rendering is one join.
+    """
+
+    __slots__ = ('source', 'parts', 'names')
+
+    def __init__(self, source, parts):
+        self.source = source
+        self.parts = tuple(parts)
+        self.names = frozenset(self.parts[1::2])
+
+    def render(self, update=None, bot_id=None, now=None):
+        if not self.names:
+            return self.parts[0]
+        now = now or datetime.now()
+        # Each variable is computed once even if it appears several times
+        values = {name: VARIABLES[name](update, bot_id, now) for name in self.names}
+        parts = list(self.parts)
+        parts[1::2] = [values[name] for name in parts[1::2]]
+        return ''.join(parts)
+
+
+def compile_template(text):
+    """Compile a response text, returns None when it has no variables
+
+    Unknown {names} are left as they are, and doubled braces are only
+    escapes in a text that uses a variable, so existing responses that
+    happen to contain braces are sent unchanged.
+    """
+    if not text or '{' not in text and '}' not in text:
+        return None
+
+    parts = []
+    literal = []
+    position = 0
+    for token in _TOKEN.finditer(text):
+        literal.append(text[position:token.start()])
+        position = token.end()
+        name = token.group(1)
+        if token.group(0) == '{{':
+            literal.append('{')
+        elif token.group(0) == '}}':
+            literal.append('}')
+        elif name in VARIABLES:
+            parts.append(''.join(literal))
+            parts.append(name)
+            literal = []
+        else:
+            literal.append(token.group(0))
+    literal.append(text[position:])
+    parts.append(''.join(literal))
+
+    if len(parts) == 1:
+        return None
+    return ResponseTemplate(text, parts)
+
+
+def render_response(rule, update=None, bot_id=None):
+    """Return the text to send for a matched Rule"""
+    if rule.template is None:
+        return rule.response_text
+    return rule.template.render(update, bot_id)
@@ -0,0 +1,210 @@
+"""
+Rule Cache
+Process-wide in-memory cache of each bot's messages and buttons so the
+message handling hot path never has to query the database
+"""
+import logging
+import threading
+from collections import namedtuple, OrderedDict
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from models import Message, Button
+from config import Config
+from matcher import RuleMatcher, DEFAULT_MATCH_TYPE
+from response_template import compile_template
+
+logger = logging.getLogger(__name__)
+
+# Inline keyboard layout; Telegram rejects keyboards with more than 100 buttons
+KEYBOARD_COLUMNS = 2
+MAX_KEYBOARD_BUTTONS = 100
+CALLBACK_PREFIX = 'b:'
+
+# Detached copy of a Button or Message row; `template` is the compiled
+# response_text, or None when it has no variables. `state` limits the rule
+# to chats in that conversation state and `next_state` is set after it replies.
+Rule = namedtuple(
+    'Rule', ['kind', 'id', 'text', 'response_text', 'match_type', 'template', 'state', 'next_state'],
+    defaults=(DEFAULT_MATCH_TYPE, None, None, None)
+)
+
+
+def callback_data(button_id):
+    """Compact callback data for an inline keyboard button"""
+    return f"{CALLBACK_PREFIX}{button_id}"
+
+
+def build_keyboard(buttons):
+    """InlineKeyboardMarkup for `buttons`, or None when there are none"""
+    keys = [
+        InlineKeyboardButton(button.text, callback_data=callback_data(button.id))
+        for button in buttons[:MAX_KEYBOARD_BUTTONS]
+    ]
+    if not keys:
+        return None
+    return InlineKeyboardMarkup([keys[i:i + KEYBOARD_COLUMNS] for i in range(0, len(keys), KEYBOARD_COLUMNS)])
+
+
+class BotRules:
+    """Immutable snapshot of a bot's rules with its compiled matcher"""
+
+    def __init__(self, bot_id, buttons, messages):
+        self.bot_id = bot_id
+        self.buttons = tuple(buttons)
+        self.messages = tuple(messages)
+        # First button wins when several share the same text; buttons
+        # waiting for a state are keyed by (state, text) instead
+        self.buttons_by_text = {}
+        self._state_buttons = {}
+        self.buttons_by_id = {button.id: button for button in self.buttons}
+        for button in self.buttons:
+            if button.state:
+                self._state_buttons.setdefault((button.state, button.text), button)
+            else:
+                self.buttons_by_text.setdefault(button.text, button)
+
+        # Buttons come first so they keep priority over auto-reply messages
+        stateless = [rule for rule in self.buttons + self.messages if not rule.state]
+        self.matcher = RuleMatcher([(rule.text, rule.match_type, rule) for rule in stateless])
+        # One matcher per conversation state, where that state's rules come
+        # before the stateless ones, so matching stays a single dict lookup
+        self.state_matchers = {}
+        for state in dict.fromkeys(rule.state for rule in self.buttons + self.messages if rule.state):
+            in_state = [rule for rule in self.buttons + self.messages if rule.state == state]
+            self.state_matchers[state] = RuleMatcher(
+                [(rule.text, rule.match_type, rule) for rule in in_state + stateless]
+            )
+
+        # Keyboards are built once per snapshot and shared by every reply; a
+        # state's keyboard lists its own buttons before the stateless ones
+        stateless_buttons = [button for button in self.buttons if not button.state]
+        self.keyboards = {None: build_keyboard(stateless_buttons)}
+        for state in dict.fromkeys(button.state for button in self.buttons if button.state):
+            self.keyboards[state] = build_keyboard(
+                [button for button in self.buttons if button.state == state] + stateless_buttons
+            )
+
+    def match(self, user_message, state=None):
+        """Return the winning Rule for a message in a conversation state, or None"""
+        return self.state_matchers.get(state, self.matcher).match(user_message)
+
+    def keyboard(self, state=None):
+        """Return the inline keyboard for a chat in a conversation state, or None"""
+        return self.keyboards.get(state, self.keyboards[None])
+
+    def button(self, text, state=None):
+        """Return the button for a callback's data in a conversation state, or None
+
+        Keyboards we send carry `b:<id>`; any other data is treated as a
+        button text, as sent by keyboards built before ids were used.
+        """
+        if text.startswith(CALLBACK_PREFIX) and text[len(CALLBACK_PREFIX):].isdigit():
+            button = self.buttons_by_id.get(int(text[len(CALLBACK_PREFIX):]))
+            # A button from an old keyboard whose state the chat has left
+            if button is not None and button.state and button.state != state:
+                return None
+            return button
+        if state is not None:
+            button = self._state_buttons.get((state, text))
+            if button is not None:
+                return button
+        return self.buttons_by_text.get(text)
+
+
+class RuleCache:
+    """Thread-safe LRU cache of compiled BotRules snapshots keyed by bot_id"""
+
+    def __init__(self, max_bots=1000):
+        self.max_bots = max_bots
+        self._rules = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rules)
+
+    def get(self, app, bot_id):
+        """Return the cached rules for a bot, loading them on first use"""
+        with self._lock:
+            rules = self._rules.get(bot_id)
+            if rules is not None:
+                self._rules.move_to_end(bot_id)
+                return rules
+            version = self._versions.get(bot_id, 0)
+
+        rules = self._load(app, bot_id)
+        self._store(bot_id, rules, version)
+        return rules
+
+    def peek(self, bot_id):
+        """Return the cached rules for a bot, or None without loading them"""
+        with self._lock:
+            rules = self._rules.get(bot_id)
+            if rules is not None:
+                self._rules.move_to_end(bot_id)
+            return rules
+
+    def reload(self, app, bot_id):
+        """Compile a bot's rules and swap them in, serving the old snapshot meanwhile
+
+        Unlike `invalidate`, the bot's next update doesn't wait for the load.
+        """
+        with self._lock:
+            version = self._versions[bot_id] = self._versions.get(bot_id, 0) + 1
+        try:
+            rules = self._load(app, bot_id)
+        except Exception:
+            self.invalidate(bot_id)
+            raise
+        self._store(bot_id, rules, version)
+        return rules
+
+    def _store(self, bot_id, rules, version):
+        with self._lock:
+            # Don't store a snapshot that was invalidated while loading
+            if self._versions.get(bot_id, 0) == version:
+                self._rules[bot_id] = rules
+                self._rules.move_to_end(bot_id)
+                # Evict the least recently used bots; they recompile on next use
+                while len(self._rules) > self.max_bots:
+                    evicted, _ = self._rules.popitem(last=False)
+                    logger.debug("Evicted rules from cache", extra={'bot_id': evicted})
+
+    def invalidate(self, bot_id):
+        """Drop a bot's cached rules so the next lookup reloads them"""
+        with self._lock:
+            self._versions[bot_id] = self._versions.get(bot_id, 0) + 1
+            self._rules.pop(bot_id, None)
+
+    def clear(self):
+        """Drop every cached bot"""
+        with self._lock:
+            for bot_id in list(self._rules):
+                self._versions[bot_id] = self._versions.get(bot_id, 0) + 1
+            self._rules.clear()
+
+    def _load(self, app, bot_id):
+        """Load a bot's buttons and messages from the database"""
+        with app.app_context():
+            buttons = [
+                Rule(
+                    'button', b.id, b.button_text, b.response_text, b.match_type,
+                    compile_template(b.response_text), b.state, b.next_state
+                )
+                for b in Button.query.filter_by(bot_id=bot_id).order_by(Button.id).all()
+            ]
+            messages = [
+                Rule(
+                    'message', m.id, m.trigger_text, m.response_text, m.match_type,
+                    compile_template(m.response_text), m.state, m.next_state
+                )
+                for m in Message.query.filter_by(bot_id=bot_id).order_by(Message.id).all()
+            ]
+        logger.debug(
+            "Loaded %d buttons and %d messages into rule cache", len(buttons), len(messages),
+            extra={'bot_id': bot_id}
+        )
+        return BotRules(bot_id, buttons, messages)
+
+
+# Global rule cache shared by the bot runtime and the web panel
+rule_cache = RuleCache(Config.RULE_CACHE_SIZE)
@@ -0,0 +1,219 @@
+"""
+Rule Import/Export
+Bulk-loads a bot's messages and buttons from CSV or JSON Lines uploads,
+parsed as a stream and inserted in batches within one transaction, and
+streams them back out in the same formats
+"""
+import csv
+import io
+import json
+import re
+from sqlalchemy import insert, select, delete
+from models import db, Message, Button
+from matcher import MATCH_TYPES, DEFAULT_MATCH_TYPE, validate_regex
+from conversation_state import MAX_STATE_LENGTH
+
+FORMATS = ('csv', 'jsonl')
+# Columns of an import or export row, in CSV order
+FIELDS = ('kind', 'text', 'match_type', 'response_text', 'state', 'next_state')
+# Rows validated and inserted per executemany
+CHUNK_SIZE = 1000
+# An import stops after this many invalid rows
+MAX_ERRORS = 20
+
+# kind -> (model, text column, longest text)
+RULE_KINDS = {
+    'message': (Message, 'trigger_text', 500),
+    'button': (Button, 'button_text', 100),
+}
+_MATCH_TYPES = {value for value, _ in MATCH_TYPES}
+# Same rule as the forms' state fields
+_STATE_PATTERN = re.compile(r'^[\w-]+$')
+
+
+class RuleImportError(Exception):
+    """Raised when an upload has invalid rows; nothing was imported"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid row(s)")
+        self.errors = errors
+
+
+def detect_format(filename, default='csv'):
+    """Pick the format from an upload's file extension"""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_records(stream, fmt):
+    """Yield (line number, dict) from an uploaded file without reading it whole"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        yield number, record if isinstance(record, dict) else "Expected a JSON object"
+
+
+def _field(record, *keys):
+    """First non-empty value among `keys` as a string, '' if none"""
+    for key in keys:
+        value = record.get(key)
+        if value is not None and value != '':
+            return str(value)
+    return ''
+
+
+def _state(value, field):
+    value = value.strip() or None
+    if value is not None:
+        if len(value) > MAX_STATE_LENGTH:
+            raise ValueError(f"{field} is longer than {MAX_STATE_LENGTH} characters")
+        if not _STATE_PATTERN.match(value):
+            raise ValueError(f'{field} may only use letters, digits, "_" and "-"')
+    return value
+
+
+def validate_record(record, default_kind='message'):
+    """Check one record, returns (kind, row for insert) or raises ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError(record)
+    kind = (_field(record, 'kind') or default_kind).strip().lower()
+    if kind not in RULE_KINDS:
+        raise ValueError(f"Unknown kind '{kind}', expected message or button")
+    _, text_column, max_length = RULE_KINDS[kind]
+
+    text = _field(record, 'text', text_column)
+    response_text = _field(record, 'response_text')
+    match_type = (_field(record, 'match_type') or DEFAULT_MATCH_TYPE).strip()
+    if not text.strip():
+        raise ValueError("text is required")
+    if len(text) > max_length:
+        raise ValueError(f"text is longer than {max_length} characters")
+    if not response_text.strip():
+        raise ValueError("response_text is required")
+    if match_type not in _MATCH_TYPES:
+        raise ValueError(f"Unknown match_type '{match_type}'")
+    if match_type == 'regex':
+        error = validate_regex(text)
+        if error:
+            raise ValueError(f"Invalid regular expression: {error}")
+
+    return kind, {
+        text_column: text,
+        'match_type': match_type,
+        'response_text': response_text,
+        'state': _state(_field(record, 'state'), 'state'),
+        'next_state': _state(_field(record, 'next_state'), 'next_state'),
+    }
+
+
+def import_rules(bot_id, records, default_kind='message', replace=False, chunk_size=CHUNK_SIZE):
+    """Insert messages and buttons from (line number, record) pairs
+
+    Rows are validated a chunk at a time and each chunk is written with
+    one executemany; everything is committed together at the end, so an
+    upload with invalid rows (RuleImportError) leaves the bot untouched.
+    With `replace` the bot's existing rules of the imported kinds are
+    deleted first. Returns {kind: rows inserted}. The caller reloads the
+    rule cache once afterwards.
+    """
+    counts = {kind: 0 for kind in RULE_KINDS}
+    errors = []
+    cleared = set()
+
+    def flush(chunk):
+        for kind, rows in chunk.items():
+            if not rows:
+                continue
+            model = RULE_KINDS[kind][0]
+            if replace and kind not in cleared:
+                db.session.execute(delete(model).where(model.bot_id == bot_id))
+                cleared.add(kind)
+            db.session.execute(insert(model), rows)
+            counts[kind] += len(rows)
+
+    try:
+        chunk = {kind: [] for kind in RULE_KINDS}
+        pending = 0
+        for number, record in records:
+            try:
+                kind, row = validate_record(record, default_kind)
+            except ValueError as e:
+                errors.append({'line': number, 'error': str(e)})
+                if len(errors) >= MAX_ERRORS:
+                    break
+                continue
+            if errors:
+                continue  # keep validating, but nothing more will be written
+            row['bot_id'] = bot_id
+            chunk[kind].append(row)
+            pending += 1
+            if pending >= chunk_size:
+                flush(chunk)
+                chunk = {kind: [] for kind in RULE_KINDS}
+                pending = 0
+        if errors:
+            raise RuleImportError(errors)
+        flush(chunk)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return counts
+
+
+def iter_rules(bot_id, kinds=None, batch_size=CHUNK_SIZE):
+    """Yield a bot's rules as export dicts, fetching `batch_size` rows at a time"""
+    for kind in kinds or RULE_KINDS:
+        model, text_column, _ = RULE_KINDS[kind]
+        statement = (
+            select(getattr(model, text_column), model.match_type, model.response_text, model.state, model.next_state)
+            .where(model.bot_id == bot_id)
+            .order_by(model.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for text, match_type, response_text, state, next_state in db.session.execute(statement):
+            yield {
+                'kind': kind, 'text': text, 'match_type': match_type, 'response_text': response_text,
+                'state': state, 'next_state': next_state,
+            }
+
+
+def to_csv(rows, batch_size=CHUNK_SIZE):
+    """Encode export dicts as CSV chunks, header first"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def to_json_lines(rows, batch_size=CHUNK_SIZE):
+    """Encode dicts as JSON Lines chunks"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False) + '\n')
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
@@ -0,0 +1,75 @@
+"""
+Rule Listing
+Keyset-paginated, searchable pages of a bot's messages and buttons for
+the panel, so a page costs the same for ten rules or twenty thousand
+"""
+from sqlalchemy import text, column, func, or_, Integer
+from models import db, Message, Button
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# The trigram tokenizer can't match queries shorter than one trigram
+MIN_FTS_QUERY_LENGTH = 3
+
+# kind -> (model, text column, full-text index created by migration 6)
+RULE_MODELS = {
+    'message': (Message, 'trigger_text', 'messages_fts'),
+    'button': (Button, 'button_text', 'buttons_fts'),
+}
+
+# Database URL -> names of the full-text tables it has
+_fts_tables = {}
+
+
+def _has_fts(table):
+    url = str(db.engine.url)
+    tables = _fts_tables.get(url)
+    if tables is None:
+        tables = _fts_tables[url] = set(db.session.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '%\\_fts' ESCAPE '\\'"
+        )).scalars())
+    return table in tables
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def count_rules(bot_id, kind):
+    model = RULE_MODELS[kind][0]
+    return db.session.query(func.count(model.id)).filter(model.bot_id == bot_id).scalar()
+
+
+def list_rules(bot_id, kind, query=None, after=None, limit=PAGE_SIZE):
+    """One page of a bot's rules of `kind` in id order
+
+    `query` matches anywhere in the trigger or response text,
+    case-insensitively, through the FTS5 trigram index when there is one.
+    `after` is the cursor returned with the previous page. Returns (rows,
+    cursor for the next page or None).
+    """
+    model, text_column, fts_table = RULE_MODELS[kind]
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rules = model.query.filter(model.bot_id == bot_id)
+    if after:
+        rules = rules.filter(model.id > after)
+
+    query = (query or '').strip()
+    if query:
+        if len(query) >= MIN_FTS_QUERY_LENGTH and _has_fts(fts_table):
+            # A quoted phrase is a plain substring search with the trigram tokenizer
+            matches = text(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :phrase").bindparams(
+                phrase='"' + query.replace('"', '""') + '"'
+            ).columns(column('rowid', Integer))
+            rules = rules.filter(model.id.in_(matches))
+        else:
+            pattern = f"%{_escape_like(query)}%"
+            rules = rules.filter(or_(
+                getattr(model, text_column).ilike(pattern, escape='\\'),
+                model.response_text.ilike(pattern, escape='\\')
+            ))
+
+    rows = rules.order_by(model.id).limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+    return rows, None
@@ -0,0 +1,109 @@
+"""
+Rule Tester
+Runs sample messages through a bot's cached rules, the same matching
+engine the running bots use, for the test page and bulk regression tests
+"""
+import io
+import json
+import random
+import time
+from response_template import render_response
+
+# Latencies kept for the summary percentiles; longer runs keep a uniform
+# random sample of this many
+MAX_LATENCY_SAMPLES = 100000
+# Result for a JSON line that has no message text
+MISSING_TEXT_ERROR = 'JSON line has no string "text" or "message.text" field'
+
+
+def iter_sample_messages(stream):
+    """Yield (line number, text) from an uploaded file without reading it whole
+
+    Each line is either plain text, a JSON object with a "text" field, or
+    a recorded Telegram update with message.text. A JSON object with
+    neither as a string yields None as its text.
+    """
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace')
+    for number, line in enumerate(text_stream, start=1):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if line.startswith('{'):
+            try:
+                data = json.loads(line)
+            except ValueError:
+                pass
+            else:
+                text = data.get('text')
+                if text is None and isinstance(data.get('message'), dict):
+                    text = data['message'].get('text')
+                yield number, text if isinstance(text, str) else None
+                continue
+        yield number, line
+
+
+def describe_rule(rule):
+    if rule is None:
+        return None
+    return {
+        'kind': rule.kind, 'id': rule.id, 'text': rule.text, 'match_type': rule.match_type,
+        'state': rule.state, 'next_state': rule.next_state,
+    }
+
+
+def match_sample(rules, text, state=None):
+    """Match one message, returns (Rule or None, latency in microseconds)"""
+    started = time.perf_counter()
+    rule = rules.match(text, state)
+    return rule, (time.perf_counter() - started) * 1e6
+
+
+def run_bulk_test(rules, samples):
+    """Yield one result dict per sample message, then a summary dict
+
+    Samples without text get a result with an "error" instead of a rule.
+    """
+    started = time.perf_counter()
+    latencies = []
+    count = matched = errors = 0
+    for number, text in samples:
+        if text is None:
+            errors += 1
+            yield {'line': number, 'message': None, 'error': MISSING_TEXT_ERROR}
+            continue
+        rule, latency_us = match_sample(rules, text)
+        count += 1
+        matched += rule is not None
+        # Reservoir sampling keeps the percentiles representative of the whole run
+        if len(latencies) < MAX_LATENCY_SAMPLES:
+            latencies.append(latency_us)
+        else:
+            slot = random.randrange(count)
+            if slot < MAX_LATENCY_SAMPLES:
+                latencies[slot] = latency_us
+        yield {
+            'line': number,
+            'message': text,
+            'rule': describe_rule(rule),
+            'response': render_response(rule) if rule else None,
+            'latency_us': round(latency_us, 2),
+        }
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 2) if latencies else 0.0
+
+    yield {
+        'summary': {
+            'messages': count,
+            'matched': matched,
+            'unmatched': count - matched,
+            'errors': errors,
+            'rules': len(rules.buttons) + len(rules.messages),
+            'p50_latency_us': percentile(0.50),
+            'p99_latency_us': percentile(0.99),
+            'latency_samples': len(latencies),
+            'total_ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+    }
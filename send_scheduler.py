@@ -0,0 +1,258 @@
+"""
+Send Scheduler
+Per-bot outbound queue that paces Telegram API calls with token buckets,
+sends callback answers before other messages and honours 429 retry_after
+without holding up update handlers
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram's documented limits: ~30 messages/s per bot, ~1 message/s per chat
+# (short bursts are tolerated) and 20 messages/minute per group
+BOT_RATE, BOT_BURST = 30.0, 30
+CHAT_RATE, CHAT_BURST = 1.0, 3
+GROUP_RATE, GROUP_BURST = 20 / 60, 5
+
+# Lower sends first
+PRIORITY_CALLBACK = 0
+PRIORITY_REPLY = 1
+
+MAX_ATTEMPTS = 3
+MAX_IN_FLIGHT = 8
+# Seconds a stopping bot waits for its queued sends before dropping them
+DRAIN_TIMEOUT = 10.0
+# Idle chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Classic token bucket; `wait` says how long until a token is free"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class SendJob:
+    __slots__ = ('priority', 'seq', 'send', 'chat_id', 'counted', 'attempts', 'queued_at', 'log_message', 'started')
+
+    def __init__(self, priority, seq, send, chat_id, counted, log_message, started):
+        self.priority = priority
+        self.seq = seq
+        self.send = send
+        self.chat_id = chat_id
+        self.counted = counted
+        self.attempts = 0
+        self.queued_at = time.perf_counter()
+        self.log_message = log_message
+        self.started = started
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler:
+    """Outbound queue for one bot, driven by a task on the bot's event loop
+
+    Handlers call `submit` and return immediately. Sends to the same chat
+    stay in order; different chats are sent concurrently within the
+    per-bot rate.
+    """
+
+    def __init__(self, bot_id, rate_limited=True):
+        self.bot_id = bot_id
+        # Benchmarks turn the token buckets off to measure raw throughput
+        self.rate_limited = rate_limited
+        self._queue = []
+        self._seq = itertools.count()
+        self._bot_bucket = None
+        self._chat_buckets = {}
+        # chat_id (None = whole bot) -> loop time until which sends are paused after a 429
+        self._paused_until = {}
+        # Chats with a send in flight, and the send tasks themselves
+        self._in_flight = set()
+        self._sending = set()
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def submit(self, send, chat_id=None, priority=PRIORITY_REPLY, counted=True, log_message=None, started=None):
+        """Queue `send`, a zero-argument callable returning the API call awaitable
+
+        Must be called from the bot's event loop. `counted` is False for
+        calls that aren't messages (answerCallbackQuery) and so skip the
+        rate limits.
+        """
+        counted = counted and self.rate_limited
+        job = SendJob(priority, next(self._seq), send, chat_id, counted, log_message, started)
+        heapq.heappush(self._queue, job)
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+        return job
+
+    async def join(self):
+        """Wait until every queued send has been attempted"""
+        while self._queue or self._sending:
+            await asyncio.sleep(0.01)
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        """Give queued sends up to `timeout` seconds to go out, then close"""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.close()
+
+    def close(self):
+        """Drop pending sends and stop the scheduler task"""
+        dropped = len(self._queue)
+        self._queue.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if dropped:
+            logger.info("Dropped %d pending send(s)", dropped, extra={'bot_id': self.bot_id})
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle(now)}
+            # Negative chat ids are groups and channels
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST, now)
+            else:
+                bucket = TokenBucket(CHAT_RATE, CHAT_BURST, now)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _job_wait(self, job, now):
+        """Seconds until `job` may be sent, ignoring the bot-wide bucket"""
+        if job.chat_id is not None and job.chat_id in self._in_flight:
+            return None  # woken when the in-flight send finishes
+        wait = 0.0
+        paused = self._paused_until.get(job.chat_id)
+        if paused is not None:
+            if paused <= now:
+                del self._paused_until[job.chat_id]
+            else:
+                wait = paused - now
+        if job.counted and job.chat_id is not None:
+            wait = max(wait, self._chat_bucket(job.chat_id, now).wait(now))
+        return wait
+
+    def _next_job(self, now):
+        """Pop the highest priority sendable job, returns (job, seconds to wait if none)"""
+        skipped = []
+        found = None
+        next_wait = None
+        bot_wait = max(self._bot_bucket.wait(now), self._paused_until.get(None, 0) - now)
+        while self._queue:
+            job = heapq.heappop(self._queue)
+            wait = self._job_wait(job, now)
+            if job.counted and wait is not None:
+                wait = max(wait, bot_wait)
+            if wait == 0:
+                found = job
+                break
+            skipped.append(job)
+            if wait is not None:
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+        for job in skipped:
+            heapq.heappush(self._queue, job)
+        return found, next_wait
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self._bot_bucket = self._bot_bucket or TokenBucket(BOT_RATE, BOT_BURST, loop.time())
+        while True:
+            self._wakeup.clear()
+            job, wait = (None, None)
+            if len(self._sending) < MAX_IN_FLIGHT:
+                job, wait = self._next_job(loop.time())
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = loop.time()
+            if job.counted:
+                self._bot_bucket.take(now)
+                if job.chat_id is not None:
+                    self._chat_bucket(job.chat_id, now).take(now)
+            if job.chat_id is not None:
+                self._in_flight.add(job.chat_id)
+            task = loop.create_task(self._send(job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, job):
+        job.attempts += 1
+        metrics.LATENCY.observe(time.perf_counter() - job.queued_at, 'send_queue')
+        try:
+            with metrics.LATENCY.time('send'):
+                await job.send()
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            retry_after = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+            # Pause just this chat, or the whole bot for sends without a chat
+            self._paused_until[job.chat_id] = asyncio.get_running_loop().time() + retry_after
+            if job.attempts < MAX_ATTEMPTS:
+                metrics.SENDS.inc(str(self.bot_id), 'retry')
+                logger.warning(
+                    "Rate limited by Telegram, retrying in %.1fs", retry_after,
+                    extra={'bot_id': self.bot_id, 'chat_id': job.chat_id}
+                )
+                heapq.heappush(self._queue, job)
+            else:
+                metrics.SENDS.inc(str(self.bot_id), 'error')
+                logger.error("Giving up on send after %d attempts", job.attempts, extra={'bot_id': self.bot_id})
+        except Exception:
+            metrics.SENDS.inc(str(self.bot_id), 'error')
+            metrics.ERRORS.inc(str(self.bot_id), 'send')
+            logger.exception("Error sending to Telegram", extra={'bot_id': self.bot_id})
+        else:
+            metrics.SENDS.inc(str(self.bot_id), 'sent')
+            if job.log_message:
+                extra = {'bot_id': self.bot_id}
+                if job.started is not None:
+                    extra['elapsed_ms'] = round((time.perf_counter() - job.started) * 1000, 3)
+                logger.info(job.log_message, extra=extra)
+        finally:
+            self._in_flight.discard(job.chat_id)
+            if self._wakeup is not None:
+                self._wakeup.set()
@@ -1,52 +1,211 @@
 """
 Logging setup for the Telegram Bot Panel
-Redirects print statements to both console and log file
+Routes log records through a queue to a background writer thread that
+writes JSON lines to the log file and readable lines to the console
 """
 import sys
-import os
+import json
+import atexit
+import time
+import queue
+import threading
+import logging
+import logging.handlers
 from datetime import datetime
 from pathlib import Path
+from config import Config
 
 # Create logs directory if it doesn't exist
 LOG_DIR = Path(__file__).parent / "logs"
 LOG_DIR.mkdir(exist_ok=True)
 
 # Log file with timestamp
-LOG_FILE = LOG_DIR / f"bot_server_{datetime.now().strftime('%Y%m%d')}.log"
-
-class TeeOutput:
-    """Class to write to both file and console"""
-    def __init__(self, *files):
-        self.files = files
-    
-    def write(self, obj):
-        for f in self.files:
-            f.write(obj)
-            f.flush()
-    
+LOG_DATE = datetime.now().strftime('%Y%m%d')
+LOG_FILE = LOG_DIR / f"bot_server_{LOG_DATE}.log"
+
+
+def worker_log_file(index):
+    """Log file of bot_runner worker `index`, named apart from the panel's bot_server_* files"""
+    return LOG_DIR / f"bot_worker{index}_{LOG_DATE}.log"
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including `extra` fields"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Human-readable console lines that still show bot_id and timings"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s', '%H:%M:%S')
+
+    def format(self, record):
+        line = super().format(record)
+        extras = [
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and not key.startswith('_')
+        ]
+        if extras:
+            line = f"{line} [{' '.join(extras)}]"
+        return line
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """File handler that flushes at most every `flush_interval` seconds
+
+    Records below ERROR stay in the file buffer until the interval passes;
+    errors are flushed immediately so crashes are never lost. The tail of
+    a burst is flushed by FlushingQueueListener once the queue goes idle.
+    """
+
+    def __init__(self, filename, flush_interval=1.0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            now = time.monotonic()
+            if record.levelno >= logging.ERROR or now - self._last_flush >= self.flush_interval:
+                self.stream.flush()
+                self._last_flush = now
+        except Exception:
+            self.handleError(record)
+
     def flush(self):
-        for f in self.files:
-            f.flush()
-
-def setup_logging():
-    """Setup logging to write to both console and file"""
-    # Open log file in append mode
-    log_file = open(LOG_FILE, 'a', encoding='utf-8')
-    
-    # Create TeeOutput to write to both stdout and file
-    sys.stdout = TeeOutput(sys.stdout, log_file)
-    sys.stderr = TeeOutput(sys.stderr, log_file)
-    
-    # Write startup message
-    print(f"\n{'='*60}")
-    print(f"Server started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"Log file: {LOG_FILE}")
-    print(f"{'='*60}\n")
-    
-    return log_file
+        super().flush()
+        self._last_flush = time.monotonic()
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """QueueListener that flushes its handlers when no record arrived for `idle_flush` seconds"""
+
+    def __init__(self, queue, *handlers, idle_flush=1.0, **kwargs):
+        super().__init__(queue, *handlers, **kwargs)
+        self.idle_flush = idle_flush
+
+    def dequeue(self, block):
+        if not block:
+            return self.queue.get(block)
+        try:
+            return self.queue.get(timeout=self.idle_flush)
+        except queue.Empty:
+            for handler in self.handlers:
+                handler.flush()
+        # Nothing is buffered any more, so wait as long as it takes
+        return self.queue.get()
 
-if __name__ == '__main__':
-    setup_logging()
-    print("Logging setup complete!")
 
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that keeps the traceback apart from the message text"""
 
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class StreamToLogger:
+    """File-like object that turns stray print() output into log records
+
+    The logger's own level is pinned to `level`, so a stricter LOG_LEVEL
+    never silently drops printed output. Partial lines are buffered per
+    thread, so prints from Flask threads, the bot runtime and executors
+    don't interleave.
+    """
+
+    def __init__(self, logger, level):
+        self.logger = logger
+        self.level = level
+        logger.setLevel(level)
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', '') + text
+        while '\n' in buffer:
+            line, buffer = buffer.split('\n', 1)
+            if line.strip():
+                self.logger.log(self.level, line.rstrip())
+        self._local.buffer = buffer
+
+    def flush(self):
+        buffer = getattr(self._local, 'buffer', '')
+        if buffer.strip():
+            self.logger.log(self.level, buffer.rstrip())
+        self._local.buffer = ''
+
+    def isatty(self):
+        return False
+
+
+def setup_logging(level=None, log_file=None):
+    """Setup queued logging to the console and the JSON log file
+
+    Returns the QueueListener that owns the writer thread.
+    """
+    level = (level or Config.LOG_LEVEL).upper()
+    log_file = log_file or LOG_FILE
+
+    console_handler = logging.StreamHandler(sys.__stdout__)
+    console_handler.setFormatter(ConsoleFormatter())
+
+    file_handler = BufferedFileHandler(log_file, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+
+    # Callers only pay for a queue put; the listener thread does all I/O
+    log_queue = queue.Queue(-1)
+    listener = FlushingQueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True,
+        idle_flush=file_handler.flush_interval
+    )
+
+    root = logging.getLogger()
+    root.handlers = [RecordQueueHandler(log_queue)]
+    root.setLevel(level)
+    # Per-request HTTP logs from the Telegram client are too noisy below WARNING
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener.start()
+    atexit.register(listener.stop)
+
+    # Route anything still printed (libraries, tracebacks) through logging too
+    sys.stdout = StreamToLogger(logging.getLogger('stdout'), logging.INFO)
+    sys.stderr = StreamToLogger(logging.getLogger('stderr'), logging.ERROR)
+
+    # Write startup message
+    logger = logging.getLogger(__name__)
+    logger.info("=" * 60)
+    logger.info(f"Server started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info(f"Log file: {log_file}, level: {level}")
+    logger.info("=" * 60)
+
+    return listener
+
+if __name__ == '__main__':
+    listener = setup_logging()
+    logging.getLogger(__name__).info("Logging setup complete!")
+    listener.stop()
@@ -6,6 +6,7 @@ document.addEventListener('DOMContentLoaded', function() {
     initializeForms();
     initializeSmoothScroll();
     initializeTooltips();
+    initializeLoadMore();
 });
 
 // Navigation Functions
@@ -234,6 +235,61 @@ function initializeTooltips() {
     });
 }
 
+// Load More (rule tables): append the next page when the button is clicked or scrolled into view
+function initializeLoadMore() {
+    document.querySelectorAll('[data-load-more]').forEach(button => {
+        const target = document.getElementById(button.dataset.target);
+        if (!target) {
+            return;
+        }
+        let loading = false;
+        
+        const loadMore = () => {
+            if (loading || !button.dataset.after) {
+                return;
+            }
+            loading = true;
+            button.disabled = true;
+            const url = new URL(button.dataset.loadMore, window.location.origin);
+            url.searchParams.set('after', button.dataset.after);
+            
+            fetch(url, { credentials: 'same-origin' })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                target.insertAdjacentHTML('beforeend', data.html);
+                if (data.next) {
+                    button.dataset.after = data.next;
+                } else {
+                    delete button.dataset.after;
+                    button.parentElement.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error loading more rules:', error);
+                showNotification('Failed to load more rules', 'error');
+            })
+            .finally(() => {
+                loading = false;
+                button.disabled = false;
+            });
+        };
+        
+        button.addEventListener('click', loadMore);
+        if ('IntersectionObserver' in window) {
+            new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) {
+                    loadMore();
+                }
+            }, { rootMargin: '200px' }).observe(button);
+        }
+    });
+}
+
 // Toggle Bot Function (for dashboard)
 function toggleBot(botId, checkbox) {
     const originalState = checkbox.checked;
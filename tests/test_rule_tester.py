@@ -0,0 +1,45 @@
+import io
+
+from rule_tester import MISSING_TEXT_ERROR, iter_sample_messages, run_bulk_test
+
+
+class Rules:
+    """Stand-in for rule_cache.BotRules that never matches"""
+
+    buttons = []
+    messages = []
+
+    def match(self, text, state=None):
+        text.lower()  # like the matcher, fails on anything but a string
+        return None
+
+
+def samples(data):
+    return list(iter_sample_messages(io.BytesIO(data)))
+
+
+def test_plain_and_json_lines():
+    data = b'hello\n\n{"text": "hi"}\n{"message": {"text": "price"}}\n{not json\n'
+    assert samples(data) == [(1, 'hello'), (3, 'hi'), (4, 'price'), (5, '{not json')]
+
+
+def test_byte_order_mark_is_stripped():
+    assert samples(b'\xef\xbb\xbf{"text": "hi"}\n') == [(1, 'hi')]
+
+
+def test_non_string_text_is_invalid():
+    assert samples(b'{"text": 5}\n{"text": null}\n') == [(1, None), (2, None)]
+
+
+def test_non_dict_message_is_invalid():
+    assert samples(b'{"message": "x"}\n{"message": {"text": ["x"]}}\n') == [(1, None), (2, None)]
+
+
+def test_invalid_lines_become_error_rows():
+    data = b'{"text": 5}\n{"message": "x"}\nhello\n'
+    results = list(run_bulk_test(Rules(), iter_sample_messages(io.BytesIO(data))))
+    assert results[0] == {'line': 1, 'message': None, 'error': MISSING_TEXT_ERROR}
+    assert results[1] == {'line': 2, 'message': None, 'error': MISSING_TEXT_ERROR}
+    assert results[2]['message'] == 'hello' and results[2]['rule'] is None
+    summary = results[-1]['summary']
+    assert (summary['messages'], summary['errors']) == (1, 2)
@@ -0,0 +1,95 @@
+"""
+Token Status Service
+Caches Telegram getMe results and refreshes them in the background so
+the dashboard never waits on the Telegram API
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStatusService:
+    """TTL cache of bot token validity backed by a pooled HTTP session"""
+
+    def __init__(self, ttl=300, max_workers=8, timeout=5):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+        # Shared keep-alive connections to the Bot API
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # token -> (is_valid, checked_at)
+        self._cache = {}
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def check(self, token):
+        """Validate a token against getMe right now and cache the result"""
+        try:
+            url = f'{Config.TELEGRAM_API_URL}{token}/getMe'
+            response = self.session.get(url, timeout=self.timeout)
+            valid = response.status_code == 200 and response.json().get('ok', False)
+        except Exception:
+            valid = False
+        with self._lock:
+            self._cache[token] = (valid, time.monotonic())
+            self._pending.discard(token)
+        return valid
+
+    def get(self, token):
+        """Return the cached validity of a token (None if unknown) without blocking
+
+        Missing or expired entries are queued for a background refresh.
+        """
+        with self._lock:
+            cached = self._cache.get(token)
+            if cached is None or time.monotonic() - cached[1] > self.ttl:
+                self._schedule(token)
+        return cached[0] if cached else None
+
+    def invalidate(self, token):
+        """Forget a token's cached status"""
+        with self._lock:
+            self._cache.pop(token, None)
+
+    def _schedule(self, token):
+        """Queue a token for refresh (caller holds the lock)"""
+        if token in self._pending:
+            return
+        self._pending.add(token)
+        self._queue.put(token)
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, daemon=True, name="TokenStatusWorker")
+            self._worker.start()
+
+    def _run(self):
+        """Background worker: refresh queued tokens in parallel batches"""
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="TokenCheck") as executor:
+            while True:
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    list(executor.map(self.check, batch))
+                except Exception:
+                    logger.exception("Token status refresh failed")
+
+
+# Global token status service
+token_status = TokenStatusService(ttl=Config.TOKEN_STATUS_TTL)
@@ -1,84 +1,288 @@
 """
 Log Viewer - View bot server logs in real-time
+Tails large log files without reading them whole and filters JSON records
+by bot, level and time range
 """
 import os
-import time
+import json
+import argparse
+import threading
+from collections import deque
 from pathlib import Path
 from datetime import datetime
 
+# Optional: use filesystem notifications for --follow when watchdog is installed
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    HAS_WATCHDOG = True
+except ImportError:
+    HAS_WATCHDOG = False
+
 LOG_DIR = Path(__file__).parent / "logs"
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+BLOCK_SIZE = 64 * 1024
+
 
-def get_latest_log_file():
-    """Get the most recent log file"""
+def get_latest_log_file(worker=None):
+    """Get the most recent log file of the panel, or of bot_runner worker `worker`"""
     if not LOG_DIR.exists():
         return None
-    
-    log_files = list(LOG_DIR.glob("bot_server_*.log"))
+
+    pattern = "bot_server_*.log" if worker is None else f"bot_worker{worker}_*.log"
+    log_files = list(LOG_DIR.glob(pattern))
     if not log_files:
         return None
-    
+
     # Return the most recent log file
     return max(log_files, key=os.path.getmtime)
 
-def view_logs(tail_lines=50, follow=False):
+
+def parse_time(value):
+    """Parse an ISO timestamp, or HH:MM[:SS] meaning today"""
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        parsed = datetime.strptime(value, '%H:%M:%S' if value.count(':') == 2 else '%H:%M')
+        return datetime.combine(datetime.now().date(), parsed.time())
+
+
+class LogFilter:
+    """Match JSON log records by bot_id, minimum level and time range"""
+
+    def __init__(self, bot_id=None, level=None, since=None, until=None):
+        self.bot_id = bot_id
+        self.min_level = LEVELS.get(level.upper(), 0) if level else 0
+        self.since = since
+        self.until = until
+
+    @property
+    def active(self):
+        return self.bot_id is not None or self.min_level or self.since or self.until
+
+    def matches(self, record):
+        if record is None:
+            # Plain text lines can't be filtered, so only show them unfiltered
+            return not self.active
+        if self.bot_id is not None and record.get('bot_id') != self.bot_id:
+            return False
+        if self.min_level and LEVELS.get(record.get('level'), 0) < self.min_level:
+            return False
+        if self.since or self.until:
+            ts = record_time(record)
+            if ts is None:
+                return False
+            if self.since and ts < self.since:
+                return False
+            if self.until and ts > self.until:
+                return False
+        return True
+
+
+def parse_record(line):
+    """Parse a JSON log line, returns None for plain text lines"""
+    if not line.startswith('{'):
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def record_time(record):
+    try:
+        return datetime.fromisoformat(record['ts'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def format_line(line, raw=False):
+    """Render a JSON record as a readable line"""
+    line = line.rstrip('\n')
+    record = None if raw else parse_record(line)
+    if record is None:
+        return line
+    extras = ' '.join(
+        f"{key}={value}" for key, value in record.items()
+        if key not in ('ts', 'level', 'logger', 'msg', 'exc')
+    )
+    text = f"{record.get('ts', '')} {record.get('level', '')} {record.get('logger', '')}: {record.get('msg', '')}"
+    if extras:
+        text += f" [{extras}]"
+    if record.get('exc'):
+        text += f"\n{record['exc']}"
+    return text
+
+
+def tail(path, lines):
+    """Return the last `lines` lines by reading backward from the end of the file"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        chunks = []
+        newlines = 0
+        # One extra newline so the first returned line is complete
+        while position > 0 and newlines <= lines:
+            step = min(BLOCK_SIZE, position)
+            position -= step
+            f.seek(position)
+            chunk = f.read(step)
+            newlines += chunk.count(b'\n')
+            chunks.append(chunk)
+    data = b''.join(reversed(chunks)).decode('utf-8', errors='replace')
+    return data.splitlines(keepends=True)[-lines:] if lines else []
+
+
+def seek_to_time(f, since):
+    """Binary-search a time-ordered log for the first line at or after `since`"""
+    f.seek(0, os.SEEK_END)
+    low, high = 0, f.tell()
+    while high - low > BLOCK_SIZE:
+        middle = (low + high) // 2
+        f.seek(middle)
+        f.readline()  # skip the partial line
+        line_start = f.tell()
+        record = parse_record(f.readline().decode('utf-8', errors='replace'))
+        ts = record_time(record) if record else None
+        if ts is None or line_start >= high:
+            # Can't tell from here; fall back to scanning the rest linearly
+            break
+        if ts < since:
+            low = line_start
+        else:
+            high = middle
+    f.seek(low)
+    if low:
+        f.readline()
+
+
+def scan(path, log_filter, limit=None):
+    """Stream the file and return the last `limit` matching lines"""
+    matches = deque(maxlen=limit)
+    with open(path, 'rb') as f:
+        if log_filter.since:
+            seek_to_time(f, log_filter.since)
+        for raw_line in f:
+            line = raw_line.decode('utf-8', errors='replace')
+            record = parse_record(line)
+            if log_filter.until and record and (record_time(record) or log_filter.until) > log_filter.until:
+                break
+            if log_filter.matches(record):
+                matches.append(line)
+    return list(matches)
+
+
+class _ChangeHandler(FileSystemEventHandler if HAS_WATCHDOG else object):
+    """Wake the follower whenever something changes in the log directory"""
+
+    def __init__(self, changed):
+        self.changed = changed
+
+    def on_any_event(self, event):
+        self.changed.set()
+
+
+def follow_file(path, log_filter, raw=False, worker=None):
+    """Print new lines as they are written, switching files on rotation"""
+    changed = threading.Event()
+    observer = None
+    if HAS_WATCHDOG:
+        observer = Observer()
+        observer.schedule(_ChangeHandler(changed), str(LOG_DIR), recursive=False)
+        observer.start()
+
+    f = open(path, 'rb')
+    f.seek(0, os.SEEK_END)
+    inode = os.fstat(f.fileno()).st_ino
+    pending = b''
+    try:
+        while True:
+            data = f.read(BLOCK_SIZE)
+            if data:
+                # Keep a trailing partial line until the writer finishes it
+                pending += data
+                *lines, pending = pending.split(b'\n')
+                for raw_line in lines:
+                    line = raw_line.decode('utf-8', errors='replace')
+                    if log_filter.matches(parse_record(line)):
+                        print(format_line(line, raw))
+                continue
+
+            # Nothing new: check for rotation (new daily file) or truncation
+            latest = get_latest_log_file(worker)
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            rotated = latest and latest != path and (current is None or os.path.getmtime(latest) >= current.st_mtime)
+            replaced = current and (current.st_ino != inode or current.st_size < f.tell())
+            if rotated or replaced:
+                f.close()
+                if rotated:
+                    path = latest
+                    print(f"\n--- Switched to {path} ---\n")
+                f = open(path, 'rb')
+                inode = os.fstat(f.fileno()).st_ino
+                pending = b''
+                continue
+
+            # Block until the filesystem reports a change (or poll without watchdog)
+            changed.wait(1.0 if observer else 0.25)
+            changed.clear()
+    finally:
+        f.close()
+        if observer:
+            observer.stop()
+            observer.join()
+
+
+def view_logs(tail_lines=50, follow=False, log_filter=None, raw=False, worker=None):
     """View log file contents"""
-    log_file = get_latest_log_file()
-    
+    log_file = get_latest_log_file(worker)
+    log_filter = log_filter or LogFilter()
+
     if not log_file:
         print("No log files found. Start the server first.")
         return
-    
+
     print(f"Viewing log file: {log_file}")
     print(f"{'='*60}\n")
-    
-    if follow:
-        # Follow mode - show last N lines and then tail
-        try:
-            with open(log_file, 'r', encoding='utf-8') as f:
-                # Read last N lines
-                lines = f.readlines()
-                if len(lines) > tail_lines:
-                    print("".join(lines[-tail_lines:]))
-                else:
-                    print("".join(lines))
-                
-                # Follow new lines
-                print("\n--- Following new log entries (Ctrl+C to stop) ---\n")
-                while True:
-                    line = f.readline()
-                    if line:
-                        print(line, end='')
-                    else:
-                        time.sleep(0.1)
-        except KeyboardInterrupt:
-            print("\n\nStopped following logs.")
-    else:
-        # Just show last N lines
-        try:
-            with open(log_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                if len(lines) > tail_lines:
-                    print("".join(lines[-tail_lines:]))
-                else:
-                    print("".join(lines))
-        except Exception as e:
-            print(f"Error reading log file: {e}")
 
-if __name__ == '__main__':
-    import sys
-    
-    follow = '--follow' in sys.argv or '-f' in sys.argv
-    tail = 50
-    
-    # Check for --tail argument
-    if '--tail' in sys.argv:
-        idx = sys.argv.index('--tail')
-        if idx + 1 < len(sys.argv):
-            try:
-                tail = int(sys.argv[idx + 1])
-            except ValueError:
-                pass
-    
-    view_logs(tail_lines=tail, follow=follow)
+    try:
+        if log_filter.active:
+            lines = scan(log_file, log_filter, tail_lines)
+        else:
+            lines = tail(log_file, tail_lines)
+        for line in lines:
+            print(format_line(line, raw))
+
+        if follow:
+            print("\n--- Following new log entries (Ctrl+C to stop) ---\n")
+            follow_file(log_file, log_filter, raw, worker)
+    except KeyboardInterrupt:
+        print("\n\nStopped following logs.")
+    except Exception as e:
+        print(f"Error reading log file: {e}")
 
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="View bot server logs")
+    parser.add_argument('-f', '--follow', action='store_true', help="keep printing new log entries")
+    parser.add_argument('--tail', type=int, default=50, help="number of lines to show (default 50)")
+    parser.add_argument('--bot-id', type=int, help="only show records for this bot")
+    parser.add_argument('--level', choices=list(LEVELS), help="minimum level to show")
+    parser.add_argument('--since', help="start time, ISO format or HH:MM[:SS] today")
+    parser.add_argument('--until', help="end time, ISO format or HH:MM[:SS] today")
+    parser.add_argument('--raw', action='store_true', help="print JSON records as written")
+    parser.add_argument('--worker', type=int, help="show this bot_runner worker's log instead of the panel's")
+    args = parser.parse_args()
+
+    view_logs(
+        tail_lines=args.tail,
+        follow=args.follow,
+        log_filter=LogFilter(args.bot_id, args.level, parse_time(args.since), parse_time(args.until)),
+        raw=args.raw,
+        worker=args.worker
+    )